@@ -0,0 +1,434 @@
+"""Shared content-equity evaluation for the recommendation notebooks (Newcomer Tasks, 1Lib1Ref, ...).
+
+The notebooks used to loop over wikis and run one query per slice, each recomputing the joins against
+wmf.wikidata_item_page_link and the gender / geography tables. Here the joined data is built once,
+persisted, and every per-wiki / per-topic / per-gender / per-region breakdown comes out of a single
+GROUPING SETS aggregation.
+
+Usage from a notebook:
+    import sys
+    sys.path.append('..')
+    import equity_eval
+
+    baseline = equity_eval.build_baseline(spark, wikidata_snapshot, wiki_dbs, gen_table, geo_table)
+    interactions = equity_eval.build_interactions(spark, newcomer_subset_tablename, events_subset_tablename)
+    breakdowns = equity_eval.equity_breakdowns(spark, interactions, baseline)
+    equity_eval.show_breakdown(breakdowns, 'wiki_topic_filter', wiki_db='fawiki', facet='gender')
+"""
+import argparse
+import os
+
+# Map individual Wikidata gender values to a few more categories so long-tail more likely to be represented.
+# Anything not listed -- e.g., non-binary, transgender person, two-spirit, genderfluid -- is 'non-binary'.
+# See for more details: https://www.wikidata.org/wiki/Property_talk:P21
+GENDER_CATEGORIES = {'male': ('Q6581097', 'Q44148', 'Q179294', 'Q15145778'),  # male, male organism, eunuch, cisgender male
+                     'female': ('Q6581072', 'Q43445', 'Q15145779'),  # female, female organism, cisgender female
+                     'transgender male': ('Q2449503', 'Q27679766'),  # transgender male, transmasculine
+                     'transgender female': ('Q1052281', 'Q27679684')}  # transgender female, transfeminine
+DEFAULT_GENDER_CATEGORY = 'non-binary'
+
+# Map individual topics to higher-level topics so trends are clearer.
+# Anything not listed -- e.g., biography, sports, women, oceania, north-america -- is kept as is.
+TOPIC_CATEGORIES = {'culture': ('food-and-drink', 'internet-culture', 'linguistics', 'fashion', 'entertainment',
+                                'software','computers-and-internet','television', 'video-games', 'society'),
+                    'arts': ('literature', 'books', 'media', 'music', 'radio', 'art', 'tv-and-film', 'films',
+                             'performing-arts', 'architecture', 'comics-and-anime', 'visual-arts'),
+                    'stem': ('general-science', 'biology', 'chemistry', 'computing', 'earth-and-environment', 'engineering',
+                             'libraries-and-information', 'mathematics', 'medicine-and-health', 'physics',
+                             'stem', 'space', 'technology', 'geographical'),
+                    'africa': ('africa', 'central-africa', 'eastern-africa', 'northern-africa', 'southern-africa', 'western-africa'),
+                    'central/south america': ('central-america', 'south-america'),
+                    'asia': ('asia', 'central-asia', 'east-asia', 'north-asia', 'south-asia', 'southeast-asia', 'west-asia'),
+                    'europe': ('eastern-europe', 'europe', 'northern-europe', 'southern-europe', 'western-europe'),
+                    'history': ('business-and-economics', 'history', 'military-and-warfare', 'transportation',
+                                'politics-and-government', 'philosophy-and-religion', 'education')}
+
+# GROUPING SETS computed by equity_breakdowns -- name -> dimensions (in addition to facet + value)
+BREAKDOWNS = {'wiki_topic_filter': ('wiki_db', 'interaction_type', 'topic_filter'),
+              'wiki_topic': ('wiki_db', 'interaction_type', 'topic'),
+              'wiki': ('wiki_db', 'interaction_type'),
+              'topic': ('interaction_type', 'topic')}
+DIMENSIONS = ('wiki_db', 'interaction_type', 'topic_filter', 'topic')
+
+
+def qid_to_gender_category(qid):
+    """Map individual Wikidata gender values to a few more categories so long-tail more likely to be represented."""
+    for category, qids in GENDER_CATEGORIES.items():
+        if qid in qids:
+            return category
+    return DEFAULT_GENDER_CATEGORY
+
+
+def topic_to_highlevel(topic):
+    """Map individual topics to higher-level topics so trends are clearer."""
+    for category, topics in TOPIC_CATEGORIES.items():
+        if topic in topics:
+            return category
+    return topic
+
+
+def _case_sql(col, categories, default):
+    whens = ' '.join(["WHEN {0} IN ({1}) THEN '{2}'".format(col, ', '.join(["'{0}'".format(v) for v in values]), category)
+                      for category, values in categories.items()])
+    return "CASE WHEN {0} IS NULL THEN NULL {1} ELSE {2} END".format(col, whens, default)
+
+
+def gender_category_sql(col):
+    """SQL equivalent of qid_to_gender_category (NULL stays NULL) so no Python UDF is needed."""
+    return _case_sql(col, GENDER_CATEGORIES, "'{0}'".format(DEFAULT_GENDER_CATEGORY))
+
+
+def topic_category_sql(col):
+    """SQL equivalent of topic_to_highlevel (NULL stays NULL)."""
+    return _case_sql(col, TOPIC_CATEGORIES, col)
+
+
+def register_udfs(spark):
+    """Register the gender_lbl / topic_lbl functions used in the notebooks' ad-hoc queries.
+
+    The UDFs are pickled by reference to this module, so it is shipped to the executors too (the notebooks'
+    sys.path.append only applies to the driver).
+    """
+    spark.sparkContext.addPyFile(os.path.abspath(__file__))
+    spark.udf.register('gender_lbl', qid_to_gender_category, 'String')
+    spark.udf.register('topic_lbl', topic_to_highlevel, 'String')
+
+
+def persist(df, view_name, checkpoint_table=None):
+    """Cache a DataFrame (or write it to a table) and expose it as a temp view so later queries reuse it."""
+    if checkpoint_table:
+        df.write.mode('overwrite').saveAsTable(checkpoint_table)
+        df = df.sparkSession.table(checkpoint_table)
+    else:
+        df = df.cache()
+    df.createOrReplaceTempView(view_name)
+    return df
+
+
+def build_baseline(spark, wikidata_snapshot, wiki_dbs, gen_table, geo_table,
+                   item_page_link_table='wmf.wikidata_item_page_link',
+                   view_name='equity_baseline', checkpoint_table=None):
+    """Baseline gender / region distribution of articles for every wiki from a single scan of the sitelinks table.
+
+    The wiki_db + QID pairs are persisted (as `<view_name>_qids`) before being joined against both the gender
+    and geography tables. Returns (and persists as `view_name`) one row per wiki_db + facet ('gender' or
+    'region') + value with the number of articles and their share of all articles on that wiki with that facet:
+    * gender: articles about humans with gender data (counted per gender statement, as in the notebooks)
+    * region: distinct articles per country (an article can count towards several countries)
+    """
+    wiki_dbs_sql = ', '.join(["'{0}'".format(w) for w in wiki_dbs])
+    qids_view = '{0}_qids'.format(view_name)
+    persist(spark.sql(f"""
+        SELECT
+          wiki_db,
+          item_id
+        FROM {item_page_link_table}
+        WHERE
+          snapshot = '{wikidata_snapshot}'
+          AND wiki_db IN ({wiki_dbs_sql})
+          AND page_namespace = 0
+    """), qids_view)
+
+    query = f"""
+    WITH baseline AS (
+        SELECT
+          q.wiki_db,
+          'gender' AS facet,
+          {gender_category_sql('g.gender')} AS value,
+          COUNT(1) AS num_articles
+        FROM {gen_table} g
+        INNER JOIN {qids_view} q
+          ON (g.item_id = q.item_id)
+        WHERE
+          g.gender IS NOT NULL
+        GROUP BY
+          q.wiki_db,
+          {gender_category_sql('g.gender')}
+        UNION ALL
+        SELECT
+          q.wiki_db,
+          'region' AS facet,
+          g.country AS value,
+          COUNT(DISTINCT(g.qid)) AS num_articles
+        FROM {geo_table} g
+        INNER JOIN {qids_view} q
+          ON (g.qid = q.item_id)
+        GROUP BY
+          q.wiki_db,
+          g.country
+    )
+    SELECT
+      wiki_db,
+      facet,
+      value,
+      num_articles,
+      num_articles / (SUM(num_articles) OVER (PARTITION BY wiki_db, facet)) AS pct_baseline
+    FROM baseline
+    """
+    return persist(spark.sql(query), view_name, checkpoint_table)
+
+
+def build_interactions(spark, edits_table, events_table=None, view_name='equity_interactions', checkpoint_table=None):
+    """Edits (and optionally impressions / clicks) with their equity facets and imputed topic filter.
+
+    Edits don't carry the topic filter so it is imputed from the most recent impression/click by the same
+    user on the same article -- see the EventLogging loss section of the Newcomer Tasks notebook.
+    `events_table` is the Newcomer Tasks events table; campaigns like 1Lib1Ref only have edits.
+    """
+    edits = f"""
+        SELECT
+          wiki_db,
+          page_id,
+          user_id,
+          gender,
+          regions,
+          '3-edit' AS interaction_type,
+          CAST(NULL AS STRING) AS task_topic,
+          TO_DATE(revision_timestamp) AS date
+        FROM {edits_table}
+    """
+    if events_table:
+        events = f"""
+        UNION ALL
+        SELECT
+          wiki_db,
+          page_id,
+          user_id,
+          gender,
+          regions,
+          CASE
+            WHEN interaction_type LIKE '%impression' THEN '1-impression'
+            WHEN interaction_type LIKE '%click' THEN '2-click'
+            ELSE '0-unexpected'
+          END AS interaction_type,
+          task_topic,
+          TO_DATE(CONCAT(year, '-', LPAD(CAST(month AS STRING), 2, '0'), '-', LPAD(CAST(day AS STRING), 2, '0'))) AS date
+        FROM {events_table}
+        """
+    else:
+        events = ""
+
+    query = f"""
+    WITH imputed_topics AS (
+        SELECT
+          wiki_db,
+          page_id,
+          user_id,
+          gender,
+          regions,
+          interaction_type,
+          LAST_VALUE(task_topic, TRUE) OVER w AS task_topic
+        FROM (
+            {edits}
+            {events}
+        ) all
+        WINDOW w AS (PARTITION BY wiki_db, page_id, user_id ORDER BY date ASC, interaction_type ASC ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+    )
+    SELECT
+      wiki_db,
+      page_id,
+      user_id,
+      interaction_type,
+      CASE WHEN task_topic IS NULL THEN NULL WHEN task_topic = 'no-topic' THEN 'no-topic' ELSE 'topic' END AS topic_filter,
+      {topic_category_sql('task_topic')} AS topic,
+      {gender_category_sql('gender')} AS gender_cat,
+      regions
+    FROM imputed_topics
+    """
+    return persist(spark.sql(query), view_name, checkpoint_table)
+
+
+def equity_breakdowns(spark, interactions_view='equity_interactions', baseline_view='equity_baseline',
+                      view_name='equity_breakdowns', checkpoint_table=None):
+    """Every breakdown in BREAKDOWNS for both gender and region in one aggregation pass.
+
+    Each interaction contributes one 'gender' row (if the article is a biography with gender data) and one
+    'region' row per associated country. Output columns:
+    * breakdown: key in BREAKDOWNS; dimensions not in the breakdown are NULL
+    * wiki_db, interaction_type, topic_filter ('topic' / 'no-topic'), topic (high-level), facet, value
+    * num_users, num_pages, num_events and pct_events (share of events within the breakdown slice)
+    * pct_baseline: share of the wiki's articles with that value (only for breakdowns that include wiki_db)
+
+    Rows whose imputed topic is unknown are kept in the breakdowns without topic dimensions and
+    dropped from the ones with them, matching the `task_topic IS NOT NULL` filter in the notebooks.
+    """
+    if not isinstance(interactions_view, str):
+        interactions_view.createOrReplaceTempView('equity_interactions')
+        interactions_view = 'equity_interactions'
+    if not isinstance(baseline_view, str):
+        baseline_view.createOrReplaceTempView('equity_baseline')
+        baseline_view = 'equity_baseline'
+
+    grouping_sets = ', '.join(['({0}, facet, value)'.format(', '.join(dims)) for dims in BREAKDOWNS.values()])
+    breakdown_case = ' '.join(["WHEN {0} THEN '{1}'".format(
+        ' AND '.join(['GROUPING({0}) = {1}'.format(d, 0 if d in dims else 1) for d in DIMENSIONS]), name)
+        for name, dims in BREAKDOWNS.items()])
+    slice_dims = ', '.join(['c.{0}'.format(d) for d in ['breakdown'] + list(DIMENSIONS) + ['facet']])
+    query = f"""
+    WITH facets AS (
+        SELECT
+          wiki_db,
+          page_id,
+          user_id,
+          interaction_type,
+          topic_filter,
+          topic,
+          f.facet AS facet,
+          f.value AS value
+        FROM {interactions_view}
+        LATERAL VIEW EXPLODE(
+          CONCAT(
+            FILTER(ARRAY(NAMED_STRUCT('facet', 'gender', 'value', gender_cat)), f -> f.value IS NOT NULL),
+            TRANSFORM(FILTER(ARRAY_DISTINCT(COALESCE(regions, ARRAY(CAST(NULL AS STRING)))), r -> r IS NOT NULL),
+                      r -> NAMED_STRUCT('facet', 'region', 'value', r))
+          )
+        ) exploded AS f
+    ),
+    counts AS (
+        SELECT
+          CASE {breakdown_case} END AS breakdown,
+          wiki_db,
+          interaction_type,
+          topic_filter,
+          topic,
+          facet,
+          value,
+          COUNT(DISTINCT(user_id)) AS num_users,
+          COUNT(DISTINCT(page_id)) AS num_pages,
+          COUNT(1) AS num_events
+        FROM facets
+        GROUP BY
+          wiki_db,
+          interaction_type,
+          topic_filter,
+          topic,
+          facet,
+          value
+        GROUPING SETS ({grouping_sets})
+    ),
+    known_topics AS (
+        SELECT
+          *
+        FROM counts
+        WHERE
+          NOT (breakdown IN ('wiki_topic_filter', 'wiki_topic', 'topic') AND COALESCE(topic_filter, topic) IS NULL)
+    )
+    SELECT
+      c.breakdown,
+      c.wiki_db,
+      c.interaction_type,
+      c.topic_filter,
+      c.topic,
+      c.facet,
+      c.value,
+      c.num_users,
+      c.num_pages,
+      c.num_events,
+      ROUND(c.num_events / SUM(c.num_events) OVER (PARTITION BY {slice_dims}), 3) AS pct_events,
+      ROUND(c.num_pages / SUM(c.num_pages) OVER (PARTITION BY {slice_dims}), 3) AS pct_pages,
+      ROUND(b.pct_baseline, 3) AS pct_baseline
+    FROM known_topics c
+    LEFT JOIN {baseline_view} b
+      ON (c.wiki_db = b.wiki_db
+          AND c.facet = b.facet
+          AND c.value = b.value)
+    """
+    return persist(spark.sql(query), view_name, checkpoint_table)
+
+
+def show_breakdown(breakdowns, breakdown, wiki_db=None, facet='gender', n=500):
+    """Print one slice of the precomputed breakdowns -- e.g., the gender table for a single wiki."""
+    df = breakdowns.filter("breakdown = '{0}' AND facet = '{1}'".format(breakdown, facet))
+    if wiki_db:
+        df = df.filter("wiki_db = '{0}'".format(wiki_db))
+    dims = [d for d in BREAKDOWNS[breakdown] if d != 'wiki_db']
+    df = df.select(*(dims + ['value', 'num_users', 'num_pages', 'num_events', 'pct_events', 'pct_pages', 'pct_baseline']))
+    df.orderBy(*(dims + [df['num_events'].desc()])).show(n, False)
+
+
+def create_fixture_tables(spark):
+    """Tiny stand-ins for the edit / event / sitelink / gender / geography tables for local-mode testing."""
+    spark.createDataFrame(
+        [('fawiki', 1, 'Q1'), ('fawiki', 2, 'Q2'), ('fawiki', 3, 'Q3'), ('frwiki', 10, 'Q1'), ('frwiki', 11, 'Q4')],
+        'wiki_db STRING, page_id BIGINT, item_id STRING'
+    ).selectExpr('*', "'2021-09-06' AS snapshot", '0 AS page_namespace').createOrReplaceTempView('fixture_item_page_link')
+    spark.createDataFrame(
+        [('Q1', 'Q6581097'), ('Q2', 'Q6581072'), ('Q4', 'Q48270')],
+        'item_id STRING, gender STRING').createOrReplaceTempView('fixture_gender')
+    spark.createDataFrame(
+        [('Q1', 'Iran'), ('Q2', 'Iran'), ('Q3', 'France'), ('Q4', 'France'), ('Q4', 'Canada')],
+        'qid STRING, country STRING').createOrReplaceTempView('fixture_geo')
+    spark.createDataFrame(
+        [('fawiki', 1, 100, 'Q6581097', ['Iran'], '2021-07-02 10:00:00'),
+         ('fawiki', 2, 100, 'Q6581072', ['Iran'], '2021-07-03 10:00:00'),
+         ('fawiki', 3, 101, None, ['France'], '2021-07-03 11:00:00'),
+         ('frwiki', 11, 200, 'Q48270', ['France', 'Canada'], '2021-07-04 10:00:00'),
+         ('frwiki', 11, 200, 'Q48270', ['France', 'Canada'], '2021-07-10 10:00:00')],
+        'wiki_db STRING, page_id BIGINT, user_id BIGINT, gender STRING, regions ARRAY<STRING>, revision_timestamp STRING'
+    ).selectExpr('wiki_db', 'page_id', 'user_id', 'gender', 'regions',
+                 'CAST(revision_timestamp AS TIMESTAMP) AS revision_timestamp').createOrReplaceTempView('fixture_edits')
+    spark.createDataFrame(
+        [('fawiki', 1, 100, 'se-task-impression', 'history', 'Q6581097', ['Iran'], 2021, 7, 1),
+         ('fawiki', 1, 100, 'se-task-click', 'history', 'Q6581097', ['Iran'], 2021, 7, 1),
+         ('fawiki', 2, 100, 'se-task-impression', 'no-topic', 'Q6581072', ['Iran'], 2021, 7, 2),
+         ('frwiki', 10, 200, 'postedit-impression', 'music', 'Q6581097', None, 2021, 7, 3),
+         ('frwiki', 11, 200, 'se-task-click', 'physics', 'Q48270', ['France', 'Canada'], 2021, 7, 9)],
+        'wiki_db STRING, page_id BIGINT, user_id BIGINT, interaction_type STRING, task_topic STRING, '
+        'gender STRING, regions ARRAY<STRING>, year INT, month INT, day INT').createOrReplaceTempView('fixture_events')
+
+
+# Expected results on the fixture tables -- description -> (query, value)
+FIXTURE_CHECKS = {
+    'baseline rows': ("SELECT COUNT(1) FROM equity_baseline", 9),
+    'interactions': ("SELECT COUNT(1) FROM equity_interactions", 10),
+    'edits with an imputed topic': (
+        "SELECT COUNT(1) FROM equity_interactions WHERE interaction_type = '3-edit' AND topic IS NOT NULL", 3),
+    # the 2021-07-10 edit follows the 2021-07-09 click, which only holds if dates sort chronologically
+    'frwiki edits imputed from the previous day\'s click': (
+        "SELECT COUNT(1) FROM equity_interactions WHERE wiki_db = 'frwiki' AND interaction_type = '3-edit' AND topic = 'stem'", 1),
+    'wiki / gender breakdown rows': (
+        "SELECT COUNT(1) FROM equity_breakdowns WHERE breakdown = 'wiki' AND facet = 'gender'", 8),
+    'wiki / region breakdown rows': (
+        "SELECT COUNT(1) FROM equity_breakdowns WHERE breakdown = 'wiki' AND facet = 'region'", 8),
+    'frwiki non-binary edits': (
+        "SELECT SUM(num_events) FROM equity_breakdowns WHERE breakdown = 'wiki' AND wiki_db = 'frwiki' "
+        "AND interaction_type = '3-edit' AND facet = 'gender' AND value = 'non-binary'", 2),
+}
+
+
+def check_fixture(spark, checks=FIXTURE_CHECKS):
+    """Compare the persisted views built from the fixture tables against `checks`. Raises AssertionError on mismatch."""
+    mismatches = []
+    for description, (query, expected) in checks.items():
+        value = spark.sql(query).collect()[0][0]
+        if value != expected:
+            mismatches.append("{0}: {1} (expected {2})".format(description, value, expected))
+    if mismatches:
+        raise AssertionError("Fixture results differ from the expected values:\n" + '\n'.join(mismatches))
+    print("{0} fixture checks passed".format(len(checks)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--breakdown", default='wiki_topic_filter', choices=list(BREAKDOWNS),
+                        help="Which breakdown to print after running on the fixture data.")
+    args = parser.parse_args()
+
+    from pyspark.sql import SparkSession
+    spark = SparkSession.builder.master('local[2]').appName('equity_eval').getOrCreate()
+    create_fixture_tables(spark)
+    build_baseline(spark, '2021-09-06', ('fawiki', 'frwiki'), 'fixture_gender', 'fixture_geo',
+                   item_page_link_table='fixture_item_page_link')
+    build_interactions(spark, 'fixture_edits', 'fixture_events')
+    breakdowns = equity_breakdowns(spark)
+    try:
+        check_fixture(spark)
+    except AssertionError as e:
+        raise SystemExit(str(e))
+    for facet in ('gender', 'region'):
+        print("\n== {0} ==".format(facet))
+        show_breakdown(breakdowns, args.breakdown, facet=facet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Export Spark results for download without funneling them through a single task.
+
+`result.coalesce(1).write.csv(...)` puts an entire (sorted) result on one executor and leaves a randomly named
+part file to find. Instead, every partition is written in parallel, a manifest lists the parts in order, and the
+single ordered TSV is rebuilt locally only when someone needs it.
+
+Usage from a notebook:
+    import sys
+    sys.path.append('..')
+    from export_utils import copy_to_local, export_partitioned, merge_parts
+
+    export_partitioned(spark, result, 'suggestbot-2021', fmt='csv.gz')  # result already ORDER BY'd
+    copy_to_local('suggestbot-2021', 'suggestbot-2021', overwrite=True)
+    merge_parts('suggestbot-2021', 'suggestbot_2021.tsv.gz')
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+MANIFEST = '_manifest.json'
+FORMATS = {'csv.gz': ('csv', 'gzip'),
+           'csv.zst': ('csv', 'zstd'),
+           'parquet': ('parquet', 'snappy')}
+
+
+def _hadoop_fs(spark, path):
+    jvm = spark._jvm
+    hpath = jvm.org.apache.hadoop.fs.Path(path)
+    return hpath.getFileSystem(spark._jsc.hadoopConfiguration()), hpath
+
+
+def export_partitioned(spark, df, path, fmt='csv.gz', sort_cols=None, num_partitions=None):
+    """Write `df` to `path` with one file per partition + a manifest of the parts in order.
+
+    Row order across parts follows partition order so an ORDER BY'd DataFrame (or `sort_cols`) comes back
+    fully ordered when the parts are read in manifest order. CSV parts have no header (columns are in the
+    manifest) and double embedded quotes so Python's csv module reads them as written.
+    """
+    kind, compression = FORMATS[fmt]
+    if sort_cols:
+        if num_partitions:
+            df = df.repartitionByRange(num_partitions, *sort_cols)
+        else:
+            df = df.repartitionByRange(*sort_cols)
+        df = df.sortWithinPartitions(*sort_cols)
+    elif num_partitions:
+        df = df.repartition(num_partitions)
+
+    if kind == 'csv':
+        (df.write.mode('overwrite')
+           .option('sep', '\t').option('header', False).option('escape', '"').option('compression', compression)
+           .csv(path))
+    else:
+        df.write.mode('overwrite').option('compression', compression).parquet(path)
+
+    fs, hpath = _hadoop_fs(spark, path)
+    parts = sorted((s.getPath().getName(), s.getLen()) for s in fs.listStatus(hpath)
+                   if s.getPath().getName().startswith('part-'))
+    manifest = {'format': fmt,
+                'columns': df.columns,
+                'sort_cols': list(sort_cols or []),
+                'parts': [{'name': name, 'bytes': size} for name, size in parts]}
+    out = fs.create(spark._jvm.org.apache.hadoop.fs.Path(path + '/' + MANIFEST), True)
+    out.write(bytearray(json.dumps(manifest, indent=1).encode('utf-8')))
+    out.close()
+    print("Wrote {0} parts ({1:.1f} MB) to {2}".format(len(parts), sum(s for _, s in parts) / 1e6, path))
+    return manifest
+
+
+def copy_to_local(hdfs_path, local_dir, overwrite=False, verbose=True):
+    """Download an exported directory from HDFS to `local_dir`.
+
+    The export is copied into a temporary directory next to `local_dir` and only swapped in once the copy
+    succeeded and has its manifest, so a failed download leaves any previous copy untouched and raises
+    (CalledProcessError / FileNotFoundError) instead of letting a later merge_parts read a partial export.
+    An existing `local_dir` is refused unless `overwrite`.
+    """
+    if os.path.exists(local_dir) and not overwrite:
+        raise FileExistsError("{0} already exists -- remove it or pass overwrite=True.".format(local_dir))
+    local_dir = os.path.abspath(local_dir)
+    tmp_dir = tempfile.mkdtemp(prefix='.{0}-'.format(os.path.basename(local_dir)), dir=os.path.dirname(local_dir))
+    try:
+        # copyToLocal into a path that does not exist yet, so the parts land at its top level
+        download_dir = os.path.join(tmp_dir, 'export')
+        cmd = ['hdfs', 'dfs', '-copyToLocal', hdfs_path, download_dir]
+        if verbose:
+            print(' '.join(cmd))
+        subprocess.run(cmd, check=True)
+        if not os.path.exists(os.path.join(download_dir, MANIFEST)):
+            raise FileNotFoundError("{0} has no {1} -- was it written by export_partitioned?".format(hdfs_path, MANIFEST))
+        if os.path.exists(local_dir):
+            os.rename(local_dir, os.path.join(tmp_dir, 'previous'))
+        os.rename(download_dir, local_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return local_dir
+
+
+def read_manifest(local_dir):
+    with open(os.path.join(local_dir, MANIFEST), 'r') as fin:
+        return json.load(fin)
+
+
+def _open_part(fn, fmt):
+    """Decompressed binary stream of a CSV part."""
+    if fmt == 'csv.gz':
+        return gzip.open(fn, 'rb')
+    import zstandard  # only needed for zstd exports
+    return zstandard.ZstdDecompressor().stream_reader(open(fn, 'rb'), read_across_frames=True, closefd=True)
+
+
+def iter_rows(local_dir):
+    """Stream rows (lists of strings / values) of a local copy of an export in manifest order."""
+    manifest = read_manifest(local_dir)
+    for part in manifest['parts']:
+        fn = os.path.join(local_dir, part['name'])
+        if manifest['format'] == 'parquet':
+            import pyarrow.parquet as pq  # only needed for parquet exports
+            for batch in pq.ParquetFile(fn).iter_batches():
+                yield from zip(*(col.to_pylist() for col in batch.columns))
+        else:
+            with _open_part(fn, manifest['format']) as fin:
+                yield from csv.reader(io.TextIOWrapper(fin, encoding='utf-8', newline=''), delimiter='\t')
+
+
+def merge_parts(local_dir, output_fn, header=True):
+    """Rebuild the single ordered TSV (gzipped if `output_fn` ends with .gz) from a local copy of an export.
+
+    gzip CSV parts are appended as-is when the output is gzipped (a multi-member gzip file is still one .gz),
+    so nothing is decompressed or recompressed.
+    """
+    manifest = read_manifest(local_dir)
+    header_line = '\t'.join(manifest['columns']) + '\n' if header else ''
+    if manifest['format'] == 'csv.gz' and output_fn.endswith('.gz'):
+        with open(output_fn, 'wb') as fout:
+            if header_line:
+                fout.write(gzip.compress(header_line.encode('utf-8')))
+            for part in manifest['parts']:
+                with open(os.path.join(local_dir, part['name']), 'rb') as fin:
+                    shutil.copyfileobj(fin, fout)
+        return output_fn
+
+    opener = gzip.open if output_fn.endswith('.gz') else open
+    with opener(output_fn, 'wt', encoding='utf-8', newline='') as fout:
+        fout.write(header_line)
+        if manifest['format'] == 'parquet':
+            writer = csv.writer(fout, delimiter='\t', lineterminator='\n')
+            for row in iter_rows(local_dir):
+                writer.writerow(['' if v is None else v for v in row])
+        else:
+            for part in manifest['parts']:
+                with _open_part(os.path.join(local_dir, part['name']), manifest['format']) as fin:
+                    shutil.copyfileobj(io.TextIOWrapper(fin, encoding='utf-8', newline=''), fout)
+    return output_fn
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--export_dir",
+                        help="Local copy of a directory written by export_partitioned (see copy_to_local).")
+    parser.add_argument("--output_tsv",
+                        help="Ordered TSV to build from the parts -- gzipped if it ends with .gz.")
+    parser.add_argument("--no_header", action="store_true",
+                        help="Do not write the column names as the first line.")
+    args = parser.parse_args()
+    merge_parts(args.export_dir, args.output_tsv, header=not args.no_header)
+    print("Wrote {0}".format(args.output_tsv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import re
+import time
+
+SB_HEADER = '== Articles you might like to edit, from SuggestBot =='
+SB_TIMESTAMP_RE = re.compile(r'(?<=\(\[\[User talk\:SuggestBot\|talk\]\]\) )[0-9][0-9]\:[0-9][0-9]\,.*(?= \(UTC\))')
+HEADING_RE = re.compile(r'^(={1,6})(.+?)(={1,6})[ \t]*$', re.M)
+HIDING_TAGS = [('<!--', '-->'), ('<nowiki', '</nowiki>'), ('<pre', '</pre>')]
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+EXPECTED_FN = 'expected_recs.json'  # recorded recommendations for the samples (the notebook's outputs)
+RECS_SCHEMA = 'Array<STRUCT<rank:Int, title:String, views:Int, quality:String, assess_class:String, pred_class:String, tag:String>>'
+
+
+class UnexpectedWikitext(Exception):
+    """Raised by the fast path when the wikitext needs a full parse to be handled correctly."""
+    pass
+
+
+def _parse_table(table):
+    """Extract recommendations from the wikitext of a SuggestBot table."""
+    col_title = [re.sub(r'\| \[\[', '', re.sub(r'\]\] \<small\>','',x)) for x in re.findall(r'\| \[\[.*\]\] \<small\>', table)]
+    col_views = [re.sub(r'\{\{formatnum\:', '', re.sub(r'\}\}','',x)) for x in re.findall(r'\{\{formatnum:[0-9]*\}\}', table)]
+    col_quality = [re.sub(r'alt\=Quality\: ', '', re.sub(',','',x)) for x in re.findall(r'alt\=Quality\: [A-z]*,', table)]
+    col_assessed_class = [re.sub(r'alt\=Quality\: [A-z]* Assessed class\: ', '', re.sub(',','',x)) for x in re.findall(r'alt\=Quality\: [A-z]*, Assessed class\: [A-z]*,', table)]
+    col_predicted_class = [re.sub(r'Predicted class\: ', '', re.sub(r'\]','',x)) for x in re.findall(r'Predicted class\: [A-z]*\]', table)]
+    col_tag = [re.sub(r'\| ', '', re.sub(r'\n\n','',x)) for x in re.findall(r'\| [A-z| ]*\n\n', table)]
+    col_tag.append(re.sub(r'\| ', '', re.sub(r'\n.*','',re.findall(r'\| [A-z| ]*\n\|\}', table)[0])))
+    col_rank = [r for r in range(1, len(col_title) + 1)]
+
+    return [[int(rank), str(title), int(views), str(quality), str(assessed_class), str(predicted_class), str(tag)] for rank,title,views,quality,assessed_class,predicted_class,tag in zip(col_rank, col_title, col_views, col_quality, col_assessed_class, col_predicted_class, col_tag)]
+
+
+def extract_recs_mwparser(wikitext):
+    """Extract list of SuggestBot recommendations + metadata from talk page wikitext.
+
+    Reference implementation: parses the full talk page with mwparserfromhell.
+    Get the most recent SuggestBot section (sometimes there are more than 1 SuggestBot sections on a page).
+
+    Example output based on the sample wikitext in samples/:
+    [[1, 'Pathological lying', 526, 'Medium', 'Start', 'C', 'Add sources'], ...]
+    """
+    import mwparserfromhell
+    from dateutil import parser
+    try:
+        wt = mwparserfromhell.parse(wikitext)
+        sections = wt.get_sections()
+        timestamps = []
+        found = False # flag that changes when we find a SuggestBot post
+        # Iterate through sections until we find the most recent SuggestBot table
+        for s in sections:
+            time = datetime.datetime(1, 1, 1, 0, 0)  # dummy timestamp of 0 if not SuggestBot
+            # If it's a SuggestBot section, update timestamp and set "found" to true.
+            if(str(s).startswith(SB_HEADER)):
+                try:
+                    # Update regex that enforces SuggestBot's account (in case timestamp somehow in e.g., article title)
+                    # and ends with the (UTC) declaration because spacing/text after the timestamp is unpredictable as
+                    # other users could comment on SuggestBot's recommendations so no guarantee they are the whole section
+                    ts = SB_TIMESTAMP_RE.search(str(s)).group(0)
+                    time = parser.parse(ts)
+                    found = True
+                except (AttributeError, ValueError):
+                    pass
+            timestamps.append(time)
+        # If we've found at least one SuggestBot table, run code below. Otherwise return None.
+        if found:
+            s = sections[timestamps.index(max(timestamps))] # Find most recent
+            table = None
+            for tag in s.filter_tags():
+                if tag.tag == 'table':
+                    table = str(tag)
+                    break
+            if table is None:
+                return None
+            return _parse_table(table)
+        else:
+            return None
+    except Exception:
+        return None
+
+
+def _inside(wikitext, idx, open_tag, close_tag):
+    """Whether offset `idx` falls within an unclosed `open_tag` -- e.g., a comment."""
+    opened = wikitext.rfind(open_tag, 0, idx)
+    return opened != -1 and wikitext.find(close_tag, opened, idx) == -1
+
+
+def _section_end(wikitext, start):
+    """Offset where the level-2 section whose heading begins at `start` ends."""
+    for m in HEADING_RE.finditer(wikitext, start + len(SB_HEADER)):
+        if min(len(m.group(1)), len(m.group(3))) <= 2:
+            return m.start()
+    return len(wikitext)
+
+
+def _table_span(section):
+    """Start/end offsets of the first wikitable in a section -- i.e. `{|` to its matching `|}`."""
+    start = None
+    depth = 0
+    offset = 0
+    for line in section.splitlines(keepends=True):
+        stripped = line.lstrip()
+        if stripped.startswith('{|'):
+            if start is None:
+                start = offset + len(line) - len(stripped)
+            depth += 1
+        elif stripped.startswith('|}') and start is not None:
+            depth -= 1
+            if depth == 0:
+                return start, offset + len(line) - len(stripped) + 2
+        offset += len(line)
+    raise UnexpectedWikitext("No complete table in SuggestBot section.")
+
+
+def _parse_timestamp(ts):
+    """Parse a signature timestamp -- e.g., '11:28, 6 October 2021'."""
+    try:
+        return datetime.datetime.strptime(ts, '%H:%M, %d %B %Y')
+    except ValueError:
+        raise UnexpectedWikitext("Unexpected timestamp: {0}".format(ts))
+
+
+def extract_recs_fast(wikitext):
+    """Extract SuggestBot recommendations without parsing the full talk page.
+
+    Finds the SuggestBot section headers with plain string search, picks the most recent section via
+    its signature timestamp, and only applies the table regexes to the first wikitable in that section.
+    Anything that the string search cannot handle with confidence (comments or nowiki around the section,
+    HTML tables, unparseable timestamps, unclosed tables) raises UnexpectedWikitext so the caller can fall back
+    to the full parse.
+    """
+    if wikitext is None or SB_HEADER not in wikitext:
+        return None
+
+    latest = None
+    latest_section = None
+    idx = wikitext.find(SB_HEADER)
+    while idx != -1:
+        if idx != 0 and wikitext[idx - 1] != '\n':
+            raise UnexpectedWikitext("SuggestBot header not at start of line.")
+        for open_tag, close_tag in HIDING_TAGS:
+            if _inside(wikitext, idx, open_tag, close_tag):
+                raise UnexpectedWikitext("SuggestBot header inside {0}.".format(open_tag))
+        line_end = wikitext.find('\n', idx)
+        if wikitext[idx + len(SB_HEADER):line_end if line_end != -1 else len(wikitext)].strip():
+            raise UnexpectedWikitext("Text after SuggestBot header.")
+        end = _section_end(wikitext, idx)
+        section = wikitext[idx:end]
+        if section.count('{{') != section.count('}}'):
+            raise UnexpectedWikitext("Unbalanced templates -- section may end inside a template.")
+        if any(open_tag in section for open_tag, _ in HIDING_TAGS):
+            raise UnexpectedWikitext("Markup that can hide headings inside SuggestBot section.")
+        ts = SB_TIMESTAMP_RE.search(section)
+        if ts is None:
+            raise UnexpectedWikitext("SuggestBot section without timestamp.")
+        ts = _parse_timestamp(ts.group(0))
+        # ties go to the earlier section to match the full-parse behavior
+        if latest is None or ts > latest:
+            latest = ts
+            latest_section = section
+        idx = wikitext.find(SB_HEADER, end)
+
+    start, end = _table_span(latest_section)
+    if '<table' in latest_section[:start].lower():
+        raise UnexpectedWikitext("HTML table before wikitable.")
+    return _parse_table(latest_section[start:end])
+
+
+def extract_recs(wikitext):
+    """Extract SuggestBot recommendations, using the fast path where possible and mwparserfromhell otherwise."""
+    try:
+        return extract_recs_fast(wikitext)
+    except Exception:
+        return extract_recs_mwparser(wikitext)
+
+
+def recs_to_pipe_delimited(recs):
+    """Convert extracted recommendations to '<rank>|<title>|<views>|<quality>|<assess_class>|<pred_class>|<tag>'."""
+    if recs is None:
+        return None
+    return ['|'.join([str(v) for v in rec]) for rec in recs]
+
+
+def _extract_recs_series(wikitexts):
+    """Vectorized wrapper: pandas Series of wikitext -> pandas Series of pipe-delimited recommendations."""
+    return wikitexts.apply(lambda wt: recs_to_pipe_delimited(extract_recs(wt)))
+
+
+def register_udfs(spark, name='extract_recs_pipe'):
+    """Register the Arrow-backed (pandas) extractor as a Spark SQL function.
+
+    Arrow cannot carry arrays of structs back from a pandas UDF on our Spark version so the UDF returns
+    pipe-delimited strings and the struct is rebuilt in SQL with `recs_struct_sql` -- e.g.,
+    `INLINE({recs_struct_sql(name).format('revision_text')})` in place of `INLINE(extract_recs(revision_text))`.
+    This file is added to the Spark context because executors import the UDF from it by name.
+    """
+    from pyspark.sql.functions import pandas_udf
+
+    spark.sparkContext.addPyFile(os.path.abspath(__file__))
+    spark.udf.register(name, pandas_udf(_extract_recs_series, 'array<string>'))
+
+
+def recs_struct_sql(udf_name, col='{0}'):
+    """SQL expression template that converts the pipe-delimited UDF output into RECS_SCHEMA structs.
+
+    Use with str.format -- e.g., `recs_struct_sql('extract_recs_pipe').format('revision_text')`.
+    Titles cannot contain pipes so only the tag (last field) is re-joined in case it does.
+    """
+    return ("TRANSFORM(TRANSFORM({0}({1}), r -> SPLIT(r, '[|]')), p -> NAMED_STRUCT("
+            "'rank', CAST(p[0] AS INT), 'title', p[1], 'views', CAST(p[2] AS INT), 'quality', p[3], "
+            "'assess_class', p[4], 'pred_class', p[5], 'tag', CONCAT_WS('|', SLICE(p, 7, SIZE(p) - 6))))").format(udf_name, col)
+
+
+STATE_SCHEMA = 'revision_timestamp STRING, revision_id BIGINT, mw_snapshot STRING'
+
+
+def create_state_table(spark, state_tablename):
+    """Table holding the newest (revision_timestamp, revision_id) scanned by each extraction run."""
+    spark.sql(f"""
+    CREATE TABLE IF NOT EXISTS {state_tablename} (
+        revision_timestamp              STRING        COMMENT 'Timestamp of the newest SuggestBot revision scanned',
+        revision_id                     BIGINT        COMMENT 'ID of the newest SuggestBot revision scanned',
+        mw_snapshot                     STRING        COMMENT 'mediawiki_wikitext_history snapshot that was scanned'
+    )
+    """)
+
+
+def get_high_water_mark(spark, state_tablename, recs_tablename=None):
+    """Newest (revision_timestamp, revision_id) already scanned -- None if nothing has been extracted yet.
+
+    Read from the state table, not the recs table, so revisions that yielded no recommendations still count as
+    scanned. If the state table is empty, falls back to the newest revision in `recs_tablename` (tables extracted
+    before the state table existed).
+    """
+    from pyspark.sql import functions as F
+
+    for tablename in [state_tablename, recs_tablename]:
+        if tablename is None:
+            continue
+        rows = spark.table(tablename).orderBy(F.desc('revision_timestamp'), F.desc('revision_id')).limit(1).collect()
+        if rows:
+            return rows[0]['revision_timestamp'], rows[0]['revision_id']
+    return None
+
+
+def new_revisions(spark, mw_snapshot, wiki_db, high_water_mark, start_date, end_date):
+    """SuggestBot talk page revisions in [start_date, end_date) that are newer than the high-water mark.
+
+    revision_timestamp is an ISO-8601 string so it can be compared directly; revision_id breaks ties between
+    revisions made in the same second. All values are bound as literals.
+    """
+    from pyspark.sql import functions as F
+
+    revisions = (spark.table('wmf.mediawiki_wikitext_history')
+                 .where((F.col('snapshot') == F.lit(mw_snapshot))
+                        & (F.col('wiki_db') == F.lit(wiki_db))
+                        & (F.col('page_namespace') == F.lit(3))
+                        & (F.col('user_text') == F.lit('SuggestBot'))
+                        & (F.col('revision_comment') == F.lit('SuggestBot recommends these articles...'))
+                        & (F.to_date('revision_timestamp') >= F.lit(start_date).cast('date'))
+                        & (F.to_date('revision_timestamp') < F.lit(end_date).cast('date'))))
+    if high_water_mark is not None:
+        hwm_timestamp, hwm_revision_id = high_water_mark
+        revisions = revisions.where((F.col('revision_timestamp') > F.lit(hwm_timestamp))
+                                    | ((F.col('revision_timestamp') == F.lit(hwm_timestamp))
+                                       & (F.col('revision_id') > F.lit(hwm_revision_id))))
+    return revisions
+
+
+def scanned_high_water_mark(revisions, previous=None):
+    """Newest (revision_timestamp, revision_id) in `revisions` -- `previous` if there are none."""
+    from pyspark.sql import functions as F
+
+    rows = (revisions.select('revision_timestamp', 'revision_id')
+            .orderBy(F.desc('revision_timestamp'), F.desc('revision_id')).limit(1).collect())
+    if not rows:
+        return previous
+    return rows[0]['revision_timestamp'], rows[0]['revision_id']
+
+
+def record_high_water_mark(spark, state_tablename, high_water_mark, mw_snapshot, overwrite=False):
+    """Store the newest revision scanned -- call only after the recs for those revisions have been written."""
+    rows = [] if high_water_mark is None else [(high_water_mark[0], int(high_water_mark[1]), mw_snapshot)]
+    if rows or overwrite:
+        spark.createDataFrame(rows, STATE_SCHEMA).write.insertInto(state_tablename, overwrite=overwrite)
+
+
+def load_samples(samples_dir=SAMPLES_DIR):
+    """Sample talk page wikitexts (copied from the testing section of the SuggestBot notebook)."""
+    samples = {}
+    for fn in sorted(glob.glob(os.path.join(samples_dir, '*.wikitext'))):
+        with open(fn, 'r', encoding='utf-8') as fin:
+            samples[os.path.basename(fn)] = fin.read()
+    return samples
+
+
+def load_expected(samples_dir=SAMPLES_DIR):
+    """Recorded recommendations for each sample -- {sample name: [[rank, title, views, ...], ...]}."""
+    with open(os.path.join(samples_dir, EXPECTED_FN), 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def check_parity(samples, expected):
+    """Check the fast path (and mwparserfromhell, if installed) against the recorded recommendations.
+
+    Returns a description of each mismatch -- empty if everything matches.
+    """
+    try:
+        import mwparserfromhell  # only needed for the reference path
+        paths = [('fast path', extract_recs_fast), ('mwparserfromhell', extract_recs_mwparser)]
+    except ImportError:
+        print("mwparserfromhell not installed -- only checking the fast path.")
+        paths = [('fast path', extract_recs_fast)]
+    mismatches = []
+    for name, wikitext in samples.items():
+        if name not in expected:
+            mismatches.append("{0}: no recorded recommendations in {1}".format(name, EXPECTED_FN))
+            continue
+        for label, fn in paths:
+            try:
+                recs = fn(wikitext)
+            except UnexpectedWikitext as e:
+                recs = None
+                print("{0}: fast path fell back ({1})".format(name, e))
+            if recs != expected[name]:
+                differing = [e for r, e in zip(recs or [], expected[name]) if r != e]
+                mismatches.append("{0}: {1} gave {2} recs ({3} recorded), {4} of them different".format(
+                    name, label, len(recs or []), len(expected[name]), len(differing)))
+            else:
+                print("{0}: {1} matches the {2} recorded recs".format(name, label, len(recs)))
+    return mismatches
+
+
+def benchmark(samples, repeats=20):
+    """Time the fast path against the full parse on the sample wikitexts."""
+    try:
+        import mwparserfromhell
+    except ImportError:
+        print("mwparserfromhell not installed -- skipping benchmark.")
+        return
+    for label, fn in [('mwparserfromhell', extract_recs_mwparser), ('fast path', extract_recs)]:
+        start_time = time.time()
+        for _ in range(repeats):
+            for wikitext in samples.values():
+                fn(wikitext)
+        elapsed = time.time() - start_time
+        print("{0}: {1:.2f} ms per talk page".format(label, 1000 * elapsed / (repeats * len(samples))))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples_dir", default=SAMPLES_DIR,
+                        help="Directory of *.wikitext SuggestBot talk pages to check.")
+    parser.add_argument("--repeats", default=20, type=int,
+                        help="Number of passes over the samples for the benchmark.")
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples_dir)
+    mismatches = check_parity(samples, load_expected(args.samples_dir))
+    if mismatches:
+        raise SystemExit("Extracted recommendations differ from the recorded ones:\n" + '\n'.join(mismatches))
+    benchmark(samples, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,10 @@ import argparse
 import random
 import time
 
-import mwapi
-import requests
-
 GENDER_QID_TO_LABEL = {'Q6581097':'Man', 'Q6581072':'Woman'}
+COMMONS_URL = 'https://commons.wikimedia.org'
+WIKIDATA_URL = 'https://wikidata.org'
+REGION_API_URL = 'https://wiki-region.wmcloud.org/api/v1/region'
 
 def filter_images(candidates):
     """Return only images -- i.e. remove audio files etc."""
@@ -66,7 +66,7 @@ def chunkify(input_list, max_size):
     for i in range(0, len(input_list), max_size):
         yield input_list[i:i+max_size]
 
-def equity_stats_images(candidate_articles, articles_recommended, lang):
+def equity_stats_images(candidate_articles, articles_recommended, lang, api_base=None, http_session=None):
     """Gather gender data about candidate and recommended images.
 
     Steps:
@@ -76,10 +76,13 @@ def equity_stats_images(candidate_articles, articles_recommended, lang):
     ** get region information
     * Computes aggregate gender / region stats for candidates and recommended images based on this info
     """
-    wd_session = mwapi.Session('https://wikidata.org', user_agent='isaac@wikimedia.org | rec test')
+    import mwapi
+    import requests
+    re_session = http_session or requests.Session()
+    wd_session = mwapi.Session(api_base or WIKIDATA_URL, user_agent='isaac@wikimedia.org | rec test', session=re_session)
+    region_url = api_base + '/api/v1/region' if api_base else REGION_API_URL
     c_gender = {}
     r_gender = {}
-    re_session = requests.Session()
     c_region = {}
     c_had_region = 0
     r_region = {}
@@ -123,7 +126,7 @@ def equity_stats_images(candidate_articles, articles_recommended, lang):
         # use QIDs to get region data
         qids = [q for q in gender_data['entities']]
         region_params = {'qid': '|'.join(qids)}
-        region_data = re_session.get(url='https://wiki-region.wmcloud.org/api/v1/region', params=region_params).json()
+        region_data = re_session.get(url=region_url, params=region_params).json()
         region_data = {r['qid']: r['regions'] for r in region_data if r['regions']}
         for qid in qids:
             if qid in region_data:
@@ -154,15 +157,22 @@ def equity_stats_images(candidate_articles, articles_recommended, lang):
         print("\t{0}: {1} ({2:.1f}%)".format(r, r_region[r], r_region[r] / r_had_region))
 
 
-def image_captions_add(iter=1, lang='en'):
+def image_captions_add(iter=1, lang='en', api_base=None, sleep=1, retries=0, retry_stats=None):
     """Simulates process of generating images to be recommended for captions in the Android App.
     Based on this code: https://github.com/wikimedia/mediawiki-services-recommendation-api/blob/master/lib/caption.js
 
     Parameters:
         iter: number of recommendation sets to test. Multiply this number by 50 to get total number of candidates considered.
         lang: target wiki for captions -- e.g., en -> English Wikipedia; ar -> Arabic Wikipedia
+        api_base: send all API requests to this host instead of production -- e.g., se_mock_api.py for load tests
+        sleep: seconds to wait between iterations
+        retries: retry rate-limited / failed API calls this many times (honouring Retry-After) -- see se_retry.py
+        retry_stats: se_retry.RetryStats to count retried calls in (e.g., for load tests)
     """
-    session = mwapi.Session('https://commons.wikimedia.org', user_agent='isaac@wikimedia.org | rec test')
+    import mwapi
+    from se_retry import retrying_session
+    http_session = retrying_session(retries, retry_stats)
+    session = mwapi.Session(api_base or COMMONS_URL, user_agent='isaac@wikimedia.org | rec test', session=http_session)
     CANDIDATE_QUERY_BASE = {
         'action': 'query',
         'formatversion': 2,
@@ -241,7 +251,7 @@ def image_captions_add(iter=1, lang='en'):
                 if i in cand_to_img:
                     num_inuse_recs += 1
                     recommended_articles.add(cand_to_img[i])
-        time.sleep(1)
+        time.sleep(sleep)
 
     print("\nFinal statistics:")
     print("Started with {0} candidates".format(num_candidates))
@@ -253,16 +263,22 @@ def image_captions_add(iter=1, lang='en'):
     print("Filter to {0} recs ({1:.1f}% of images) -- {2} ({3:.1f}% of recs) in use on {4}wiki".format(
         num_recs, 100 * num_recs / num_images, num_inuse_recs, 100 * num_inuse_recs / num_recs, lang))
 
-    equity_stats_images(candidate_articles, recommended_articles, lang)
+    equity_stats_images(candidate_articles, recommended_articles, lang, api_base, http_session)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--num_calls", default=1, type=int)
     parser.add_argument("--lang", default='en')
-    args = parser.parse_args()
+    parser.add_argument("--api_base",
+                        help="Send all API requests to this host instead of production -- e.g., http://localhost:8080 for se_mock_api.py")
+    parser.add_argument("--sleep", default=1, type=float,
+                        help="Seconds to wait between iterations.")
+    parser.add_argument("--retries", default=0, type=int,
+                        help="Retry rate-limited (429) / failed (5xx) API calls this many times, honouring Retry-After.")
+    args = parser.parse_args(argv)
 
-    image_captions_add(args.num_calls, args.lang)
+    image_captions_add(args.num_calls, args.lang, args.api_base, args.sleep, args.retries)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
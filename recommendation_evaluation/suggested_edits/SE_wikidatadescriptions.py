@@ -1,10 +1,9 @@
 import argparse
 import time
 
-import mwapi
-import requests
-
 GENDER_QID_TO_LABEL = {'Q6581097':'Man', 'Q6581072':'Woman'}
+WIKIDATA_URL = 'https://wikidata.org'
+REGION_API_URL = 'https://wiki-region.wmcloud.org/api/v1/region'
 
 def filter_articles(candidates, reasons):
     """Filter articles to allowed set for recommendations.
@@ -91,14 +90,16 @@ def add_gender_data(candidates, wd_session, gdata):
         else:
             print("Missing from gender data:", c)
 
-def add_region_data(candidates, gdata):
+def add_region_data(candidates, gdata, region_url=REGION_API_URL, session=None):
     """Add gender data (P21) for Wikidata items if humans (P31:Q5)"""
     qids = '|'.join([c['pageprops']['wikibase_item'] for c in candidates if c.get('pageprops', {}).get('wikibase_item')])
     REGION_QUERY_BASE = {
         'qid': qids
     }
-    session = requests.Session()
-    region_data = session.get(url='https://wiki-region.wmcloud.org/api/v1/region', params=REGION_QUERY_BASE).json()
+    if session is None:
+        import requests
+        session = requests.Session()
+    region_data = session.get(url=region_url, params=REGION_QUERY_BASE).json()
     region_data = {r['qid']:r['regions'] for r in region_data if r['regions']}
     for i in range(len(candidates)):
         c = candidates[i]
@@ -109,16 +110,25 @@ def add_region_data(candidates, gdata):
             for region in region_data[qid]:
                 gdata[region] = gdata.get(region, 0) + 1
 
-def wikidata_description_add(iter=1, lang='en'):
+def wikidata_description_add(iter=1, lang='en', api_base=None, sleep=1, retries=0, retry_stats=None):
     """Simulates process of generating Wikidata items to be recommended for descriptions in the Android App.
     Based on this code: https://github.com/wikimedia/mediawiki-services-recommendation-api/blob/master/lib/description.js
 
     Parameters:
         iter: number of recommendation sets to test. Multiply this number by 50 to get total number of candidates considered.
         lang: target wiki for descriptions -- e.g., en -> English Wikipedia; ar -> Arabic Wikipedia
+        api_base: send all API requests to this host instead of production -- e.g., se_mock_api.py for load tests
+        sleep: seconds to wait between iterations
+        retries: retry rate-limited / failed API calls this many times (honouring Retry-After) -- see se_retry.py
+        retry_stats: se_retry.RetryStats to count retried calls in (e.g., for load tests)
     """
-    lang_session = mwapi.Session('https://{0}.wikipedia.org'.format(lang), user_agent='isaac@wikimedia.org | rec test')
-    wd_session = mwapi.Session('https://wikidata.org', user_agent='isaac@wikimedia.org | rec test')
+    import mwapi
+    from se_retry import retrying_session
+    http_session = retrying_session(retries, retry_stats)
+    region_url = api_base + '/api/v1/region' if api_base else REGION_API_URL
+    lang_session = mwapi.Session(api_base or 'https://{0}.wikipedia.org'.format(lang), user_agent='isaac@wikimedia.org | rec test',
+                                 session=http_session)
+    wd_session = mwapi.Session(api_base or WIKIDATA_URL, user_agent='isaac@wikimedia.org | rec test', session=http_session)
     CANDIDATE_QUERY_BASE = {
         'action': 'query',
         'generator': 'random',
@@ -145,7 +155,7 @@ def wikidata_description_add(iter=1, lang='en'):
         candidates = lang_session.get(**CANDIDATE_QUERY_BASE)
         candidates = candidates['query']['pages']
         add_gender_data(candidates, wd_session, candidate_gdata)
-        add_region_data(candidates, candidate_rdata)
+        add_region_data(candidates, candidate_rdata, region_url, http_session)
         num_candidates += len(candidates)
 
         # filter articles to acceptable Wikidata items
@@ -177,7 +187,7 @@ def wikidata_description_add(iter=1, lang='en'):
                 for r in items_to_rec[qid]['regions']:
                     rec_rdata[r] = rec_rdata.get(r, 0) + 1
 
-        time.sleep(1)
+        time.sleep(sleep)
 
     print("\nFinal statistics:")
     print("Started with {0} candidates".format(num_candidates))
@@ -212,13 +222,19 @@ def wikidata_description_add(iter=1, lang='en'):
                                                            100 * rec_rdata[r] / rec_rdata['regions']))
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--num_calls", default=1, type=int)
     parser.add_argument("--lang", default='en')
-    args = parser.parse_args()
-
-    wikidata_description_add(args.num_calls, args.lang)
+    parser.add_argument("--api_base",
+                        help="Send all API requests to this host instead of production -- e.g., http://localhost:8080 for se_mock_api.py")
+    parser.add_argument("--sleep", default=1, type=float,
+                        help="Seconds to wait between iterations.")
+    parser.add_argument("--retries", default=0, type=int,
+                        help="Retry rate-limited (429) / failed (5xx) API calls this many times, honouring Retry-After.")
+    args = parser.parse_args(argv)
+
+    wikidata_description_add(args.num_calls, args.lang, args.api_base, args.sleep, args.retries)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import multiprocessing
+import os
+import threading
+import time
+
+import requests
+
+from se_mock_api import MockAPIServer, add_config_args, config_from_args
+from se_retry import RetryStats
+from SE_imagecaptions import image_captions_add
+from SE_wikidatadescriptions import wikidata_description_add
+
+SIMULATORS = {'descriptions': wikidata_description_add,
+              'captions': image_captions_add}
+
+
+def start_mock_server(config):
+    """Run se_mock_api in a child process (so it doesn't compete with the simulators for the GIL). Returns (api_base, process)."""
+    server = MockAPIServer(('127.0.0.1', 0), config)
+    process = multiprocessing.get_context('fork').Process(target=server.serve_forever, daemon=True)
+    process.start()
+    server.socket.close()  # the child keeps its own copy of the listening socket
+    return 'http://127.0.0.1:{0}'.format(server.server_address[1]), process
+
+
+def get_stats(api_base):
+    return requests.get(api_base + '/__stats').json()
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run_load_test(simulator, api_base, iterations=20, concurrency=1, lang='en', retries=0):
+    """Run `iterations` single-iteration simulations with `concurrency` threads and summarize throughput / latency / failures.
+
+    API calls that get an injected error or rate limit are retried up to `retries` times (honouring Retry-After) and
+    counted as recovered if a retry succeeded or failed otherwise.
+    """
+    fn = SIMULATORS[simulator]
+    retry_stats = RetryStats()
+    latencies = []
+    failures = {}
+    lock = threading.Lock()
+
+    def one_iteration(_):
+        start_time = time.time()
+        try:
+            fn(iter=1, lang=lang, api_base=api_base, sleep=0, retries=retries, retry_stats=retry_stats)
+            latencies.append(time.time() - start_time)
+        except Exception as e:
+            with lock:
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+
+    before = get_stats(api_base)
+    start_time = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one_iteration, range(iterations)))
+    elapsed = time.time() - start_time
+    after = get_stats(api_base)
+
+    requests_made = after['requests'] - before['requests']
+    return {'simulator': simulator,
+            'concurrency': concurrency,
+            'retries': retries,
+            'iterations': iterations,
+            'succeeded': len(latencies),
+            'failed': failures,
+            'seconds': elapsed,
+            'requests': requests_made,
+            'requests_per_sec': requests_made / elapsed,
+            'iterations_per_sec': len(latencies) / elapsed,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+            'latency_max': max(latencies, default=float('nan')),
+            'injected_errors': after['errors'] - before['errors'],
+            'injected_rate_limits': after['rate_limited'] - before['rate_limited'],
+            'retried_calls': retry_stats.counts['retried_calls'],
+            'recovered_calls': retry_stats.counts['recovered'],
+            'failed_calls': retry_stats.counts['failed'],
+            'retry_requests': retry_stats.counts['retries']}
+
+
+def print_result(result):
+    print("{simulator} x{concurrency}: {succeeded}/{iterations} iterations OK in {seconds:.1f}s -- "
+          "{requests_per_sec:.1f} requests/s, {iterations_per_sec:.2f} iterations/s".format(**result))
+    print("\titeration latency p50 {latency_p50:.3f}s / p95 {latency_p95:.3f}s / max {latency_max:.3f}s".format(**result))
+    if result['injected_errors'] or result['injected_rate_limits'] or result['failed']:
+        print("\tinjected: {injected_errors} errors + {injected_rate_limits} rate limits -> {retried_calls} calls hit one: "
+              "{recovered_calls} recovered and {failed_calls} failed with up to {retries} retries ({retry_requests} retry requests); "
+              "failed iterations: {failed}".format(**result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--simulator", nargs='*', default=sorted(SIMULATORS), choices=sorted(SIMULATORS))
+    parser.add_argument("--iterations", default=20, type=int,
+                        help="Number of recommendation sets (simulator iterations) per run.")
+    parser.add_argument("--concurrency", nargs='*', default=[1], type=int,
+                        help="Thread counts to compare -- e.g., 1 4 16.")
+    parser.add_argument("--retries", default=3, type=int,
+                        help="Retry API calls that get an injected error or rate limit up to this many times "
+                             "(honouring Retry-After). 0 = no retries.")
+    parser.add_argument("--lang", default='en')
+    parser.add_argument("--api_base",
+                        help="Use an already running se_mock_api.py (e.g., http://localhost:8080) instead of starting one.")
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    process = None
+    api_base = args.api_base
+    if not api_base:
+        api_base, process = start_mock_server(config_from_args(args))
+    try:
+        for simulator in args.simulator:
+            for concurrency in args.concurrency:
+                print_result(run_load_test(simulator, api_base, args.iterations, concurrency, args.lang, args.retries))
+    finally:
+        if process is not None:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
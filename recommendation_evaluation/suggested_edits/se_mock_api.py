@@ -0,0 +1,253 @@
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the APIs called by SE_wikidatadescriptions.py and SE_imagecaptions.py so they can be load-tested
+# without touching production. One host serves all of them:
+#   /w/api.php        -- MediaWiki / Wikibase Action API (Wikipedia, Commons and Wikidata requests)
+#   /api/v1/region    -- wiki-region API
+#   /__stats          -- request / injected failure counts (JSON)
+# Responses are synthetic but deterministic for a given seed + ID so repeated lookups of an item agree.
+
+GENDERS = [('Q6581097', 0.75), ('Q6581072', 0.22), ('Q1052281', 0.03)]
+REGIONS = ['United States of America', 'United Kingdom', 'India', 'France', 'Japan', 'Nigeria', 'Brazil', 'Germany']
+PROTECTED = [{'type': 'edit', 'level': 'sysop', 'expiry': 'infinity'}]
+
+
+class MockConfig:
+    """Latency / failure behavior of the mock server."""
+
+    def __init__(self, latency_ms=50, jitter_ms=20, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+
+
+def _rng(seed, key):
+    return random.Random('{0}-{1}'.format(seed, key))
+
+
+def _claims(seed, qid):
+    """P31 (instance of) and P21 (sex or gender) claims for a synthetic item -- ~30% humans."""
+    rng = _rng(seed, qid)
+    if rng.random() > 0.3:
+        return {'P31': [{'mainsnak': {'datavalue': {'value': {'id': 'Q4167410'}}}}]}
+    claims = {'P31': [{'mainsnak': {'datavalue': {'value': {'id': 'Q5'}}}}]}
+    if rng.random() < 0.9:
+        gender = rng.choices([g for g, _ in GENDERS], weights=[w for _, w in GENDERS])[0]
+        claims['P21'] = [{'mainsnak': {'datavalue': {'value': {'id': gender}}}}]
+    return claims
+
+
+def title_to_qid(title):
+    """Stable synthetic QID for an article title."""
+    return 'Q{0}'.format(1 + sum((i + 1) * ord(c) for i, c in enumerate(title.replace('_', ' '))) % 10000000)
+
+
+def random_articles(rng, limit):
+    """generator=random&grnnamespace=0 with prop=pageprops|description|info"""
+    pages = []
+    for _ in range(limit):
+        pid = rng.randint(1, 70000000)
+        page = {'pageid': pid, 'ns': 0, 'title': 'Synthetic article {0}'.format(pid),
+                'protection': PROTECTED if rng.random() < 0.02 else []}
+        r = rng.random()
+        if r < 0.03:
+            del page['protection']
+            pages.append(page)  # e.g., page deleted between generator and prop lookups
+            continue
+        elif r < 0.08:
+            page['pageprops'] = {'disambiguation': ''}
+        elif r < 0.15:
+            page['pageprops'] = {}
+        else:
+            page['pageprops'] = {'wikibase_item': 'Q{0}'.format(pid)}
+        if rng.random() < 0.5:
+            page['description'] = 'synthetic description'
+            page['descriptionsource'] = 'central'
+        pages.append(page)
+    return pages
+
+
+def random_files(rng, limit):
+    """generator=random&grnnamespace=6 with prop=imageinfo|globalusage|info"""
+    pages = []
+    for _ in range(limit):
+        pid = rng.randint(1, 100000000)
+        mime = 'image/jpeg' if rng.random() < 0.9 else 'audio/ogg'
+        usage = []
+        for _ in range(rng.choice([0, 0, 0, 1, 1, 2, 3])):
+            title = 'Article_{0}'.format(rng.randint(1, 5000000))
+            wiki = 'en.wikipedia.org' if rng.random() < 0.5 else rng.choice(['fr.wikipedia.org', 'www.wikidata.org', 'en.wiktionary.org'])
+            usage.append({'title': title, 'wiki': wiki, 'pageid': str(rng.randint(1, 70000000))})
+        pages.append({'pageid': pid, 'ns': 6, 'title': 'File:Synthetic {0}.jpg'.format(pid),
+                      'protection': PROTECTED if rng.random() < 0.02 else [],
+                      'imageinfo': [{'timestamp': '2021-01-01T00:00:00Z', 'user': 'Synthetic', 'mime': mime,
+                                     'url': 'https://example.org/{0}.jpg'.format(pid)}],
+                      'globalusage': usage})
+    return pages
+
+
+def wbgetentities(seed, params):
+    entities = {}
+    if params.get('ids'):
+        for eid in params['ids'].split('|'):
+            rng = _rng(seed, eid)
+            if eid.startswith('M'):
+                if rng.random() < 0.3:
+                    entities[eid] = {'id': eid, 'missing': ''}
+                else:
+                    labels = {'en': {'language': 'en', 'value': 'caption'}} if rng.random() < 0.2 else {}
+                    entities[eid] = {'id': eid, 'type': 'mediainfo', 'labels': labels}
+            else:
+                entities[eid] = {'id': eid, 'type': 'item', 'claims': _claims(seed, eid)}
+    elif params.get('titles'):
+        site = params.get('sites', 'enwiki')
+        for title in params['titles'].split('|'):
+            qid = title_to_qid(title)
+            entities[qid] = {'id': qid, 'type': 'item', 'claims': _claims(seed, qid),
+                             'sitelinks': {site: {'site': site, 'title': title.replace('_', ' ')}}}
+    return {'success': 1, 'entities': entities}
+
+
+def regions(seed, qids):
+    result = []
+    for qid in qids:
+        rng = _rng(seed, 'region-' + qid)
+        result.append({'qid': qid, 'regions': rng.sample(REGIONS, rng.choice([1, 1, 2])) if rng.random() < 0.6 else []})
+    return result
+
+
+class MockAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, MockAPIHandler)
+        self.config = config
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'rate_limited': 0, 'by_endpoint': {}}
+        self.request_counter = 0
+
+    def count(self, endpoint, outcome=None):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['by_endpoint'][endpoint] = self.stats['by_endpoint'].get(endpoint, 0) + 1
+            if outcome:
+                self.stats[outcome] += 1
+            self.request_counter += 1
+            return self.request_counter
+
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._handle(parse_qs(self.rfile.read(length).decode('utf-8')))
+
+    def do_GET(self):
+        self._handle({})
+
+    def _handle(self, body_params):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        params.update({k: v[0] for k, v in body_params.items()})
+        server = self.server
+        config = server.config
+
+        if url.path == '/__stats':
+            with server.lock:
+                return self._send(200, server.stats)
+
+        endpoint = 'region' if url.path == '/api/v1/region' else params.get('action', url.path)
+        if params.get('generator'):
+            endpoint = 'generator={0}&ns={1}'.format(params['generator'], params.get('grnnamespace'))
+        delay = max(0.0, random.gauss(config.latency_ms, config.jitter_ms)) / 1000
+        time.sleep(delay)
+        r = random.random()
+        if r < config.rate_limit_rate:
+            server.count(endpoint, 'rate_limited')
+            return self._send(429, {'error': {'code': 'ratelimited', 'info': "You've exceeded your rate limit."}},
+                              {'Retry-After': str(config.retry_after)})
+        if r < config.rate_limit_rate + config.error_rate:
+            server.count(endpoint, 'errors')
+            return self._send(500, {'error': {'code': 'internal_api_error_DBQueryError', 'info': 'Synthetic failure'}})
+        request_id = server.count(endpoint)
+
+        if url.path == '/api/v1/region':
+            return self._send(200, regions(config.seed, [q for q in params.get('qid', '').split('|') if q]))
+        if url.path != '/w/api.php':
+            return self._send(404, {'error': {'code': 'notfound', 'info': url.path}})
+        if params.get('action') == 'wbgetentities':
+            return self._send(200, wbgetentities(config.seed, params))
+        if params.get('action') == 'query' and params.get('generator') == 'random':
+            rng = _rng(config.seed, 'random-{0}'.format(request_id))
+            limit = int(params.get('grnlimit', 10))
+            pages = random_files(rng, limit) if params.get('grnnamespace') == '6' else random_articles(rng, limit)
+            return self._send(200, {'batchcomplete': True, 'query': {'pages': pages}})
+        if params.get('action') == 'query' and params.get('titles') is not None:
+            pages = []
+            for title in params['titles'].split('|'):
+                if title:
+                    protection = PROTECTED if _rng(config.seed, 'protect-' + title).random() < 0.05 else []
+                    pages.append({'ns': 0, 'title': title, 'protection': protection})
+            return self._send(200, {'batchcomplete': True, 'query': {'pages': pages}})
+        return self._send(400, {'error': {'code': 'badparams', 'info': 'Not implemented by mock: {0}'.format(params)}})
+
+
+def serve(port=8080, config=None, host='127.0.0.1'):
+    """Run the mock server until interrupted."""
+    server = MockAPIServer((host, port), config or MockConfig())
+    print("Mock API serving on http://{0}:{1}".format(host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def add_config_args(parser):
+    parser.add_argument("--latency_ms", default=50, type=float, help="Mean latency added to each response.")
+    parser.add_argument("--jitter_ms", default=20, type=float, help="Standard deviation of the added latency.")
+    parser.add_argument("--error_rate", default=0.0, type=float, help="Share of requests that fail with HTTP 500.")
+    parser.add_argument("--rate_limit_rate", default=0.0, type=float, help="Share of requests rejected with HTTP 429.")
+    parser.add_argument("--retry_after", default=1, type=int, help="Retry-After (seconds) sent with HTTP 429 responses.")
+    parser.add_argument("--seed", default=0, type=int, help="Seed for the synthetic data.")
+
+
+def config_from_args(args):
+    return MockConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                      rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", default=8080, type=int)
+    add_config_args(parser)
+    args = parser.parse_args()
+    serve(args.port, config_from_args(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Bounded retries for the Suggested Edits simulators' API calls.
+
+Rate-limited (HTTP 429) and server-error (5xx) responses are retried up to `retries` times, waiting for as long as
+the Retry-After header asks (or an exponential backoff without one) but never more than `max_wait` seconds. Every
+call that needed a retry is counted in a RetryStats as recovered or failed so load tests can report both.
+"""
+import threading
+import time
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryStats:
+    """Thread-safe counts of calls that got a retryable response -- see `retrying_session`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {'retried_calls': 0, 'recovered': 0, 'failed': 0, 'retries': 0}
+
+    def add(self, retries, recovered):
+        with self.lock:
+            self.counts['retried_calls'] += 1
+            self.counts['recovered' if recovered else 'failed'] += 1
+            self.counts['retries'] += retries
+
+
+def retry_wait(response, attempt, max_wait=30):
+    """Seconds to wait before retrying: Retry-After if given in seconds, else 0.5s doubling with each attempt."""
+    try:
+        wait = float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        wait = 0.5 * 2 ** attempt
+    return min(max(wait, 0), max_wait)
+
+
+def retrying_session(retries=0, stats=None, max_wait=30):
+    """requests.Session whose requests are retried on RETRY_STATUSES (pass it to mwapi.Session via `session=`).
+
+    After the last attempt the failing response is returned as is so callers see the same error they would without
+    retries.
+    """
+    import requests
+    session = requests.Session()
+    send = session.request
+
+    def request(method, url, **kwargs):
+        attempt = 0
+        response = send(method, url, **kwargs)
+        while response.status_code in RETRY_STATUSES and attempt < retries:
+            response.close()
+            time.sleep(retry_wait(response, attempt, max_wait))
+            attempt += 1
+            response = send(method, url, **kwargs)
+        if stats is not None and (attempt or response.status_code in RETRY_STATUSES):
+            stats.add(attempt, response.status_code not in RETRY_STATUSES)
+        return response
+
+    session.request = request
+    return session
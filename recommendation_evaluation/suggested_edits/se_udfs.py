@@ -0,0 +1,170 @@
+import argparse
+import random
+import time
+
+
+def mode(value_list):
+    """Determine value that occurs the most in a list.
+
+    For example, if an image is associated with three articles about men and one article about a woman, this will return man.
+    Ties go to the value that appears first in the list. Missing or empty lists have no mode (None).
+    """
+    if value_list is None or len(value_list) == 0:
+        return None
+    counts = {}
+    for v in value_list:
+        counts[v] = counts.get(v, 0) + 1
+    mode = sorted(counts, key=counts.get, reverse=True)[0]
+    return mode
+
+
+def list_to_set(value_list):
+    """Deduplicate a list (as strings). Missing elements stay None, as they do in SQL."""
+    if value_list is None:
+        return None
+    return list(set([None if v is None else str(v) for v in value_list]))
+
+
+def mode_sql(col):
+    """Built-in Spark SQL equivalent of `mode` -- i.e. no Python worker or serialization involved.
+
+    Folds over the distinct values (which keep first-occurrence order) and only replaces the running
+    winner on a strictly larger count so ties go to the earliest value, same as `mode`.
+    """
+    return ("AGGREGATE(ARRAY_DISTINCT({0}), NAMED_STRUCT('value', CAST(NULL AS STRING), 'n', 0), "
+            "(acc, v) -> IF(SIZE(FILTER({0}, x -> x <=> v)) > acc.n, "
+            "NAMED_STRUCT('value', CAST(v AS STRING), 'n', SIZE(FILTER({0}, x -> x <=> v))), acc), "
+            "acc -> acc.value)").format(col)
+
+
+def list_to_set_sql(col):
+    """Built-in Spark SQL equivalent of `list_to_set`."""
+    return "ARRAY_DISTINCT(TRANSFORM({0}, x -> CAST(x AS STRING)))".format(col)
+
+
+def _mode_series(value_lists):
+    return value_lists.apply(mode)
+
+
+def _list_to_set_series(value_lists):
+    return value_lists.apply(list_to_set)
+
+
+def register_udfs(spark):
+    """Register vectorized (Arrow / pandas) versions of `mode` and `list_to_set` as Spark SQL functions.
+
+    Prefer `mode_sql` / `list_to_set_sql` in queries -- these are for when a Python UDF is unavoidable.
+    """
+    from pyspark.sql.functions import pandas_udf
+
+    spark.udf.register('mode', pandas_udf(_mode_series, 'string'))
+    spark.udf.register('list_to_set', pandas_udf(_list_to_set_series, 'array<string>'))
+
+
+def _fixture_lists(num_rows, seed=0):
+    """Lists of Wikidata gender / region values with plenty of ties and duplicates."""
+    rng = random.Random(seed)
+    values = ['Q6581097', 'Q6581072', 'Q1052281', 'Q48270', 'United States of America', 'Japan']
+    lists = [['Q6581097'], ['Q6581097', 'Q6581072'], ['Q6581072', 'Q6581097'],
+             ['Q6581072', 'Q6581097', 'Q6581097', 'Q6581072'], ['Japan', 'Japan', 'Japan']]
+    while len(lists) < num_rows:
+        lists.append([rng.choice(values) for _ in range(rng.randint(1, 12))])
+    return lists[:num_rows]
+
+
+# (list, expected mode, expected set): ties, missing / empty lists, and missing elements
+EDGE_CASES = [(['Q6581097', 'Q6581072'], 'Q6581097', {'Q6581097', 'Q6581072'}),
+              (['Q6581072', 'Q6581097', 'Q6581097', 'Q6581072'], 'Q6581072', {'Q6581097', 'Q6581072'}),
+              (['Japan', 'Q48270', 'Q1052281', 'Q1052281', 'Q48270', 'Japan'], 'Japan', {'Japan', 'Q48270', 'Q1052281'}),
+              (None, None, None),
+              ([], None, set()),
+              ([None], None, {None}),
+              ([None, 'Japan', 'Japan', None], None, {None, 'Japan'}),
+              (['Japan', None, None, 'Japan'], 'Japan', {None, 'Japan'}),
+              (['Q6581072', None, 'Q6581097', None], None, {None, 'Q6581072', 'Q6581097'})]
+
+
+def check_python(edge_cases=EDGE_CASES):
+    """Check `mode` and `list_to_set` against the hand-written expectations in `edge_cases`."""
+    mismatches = []
+    for value_list, expected_mode, expected_set in edge_cases:
+        value_set = list_to_set(value_list)
+        if mode(value_list) != expected_mode or (None if value_set is None else set(value_set)) != expected_set:
+            mismatches.append("{0}: mode {1} (expected {2}), set {3} (expected {4})".format(
+                value_list, mode(value_list), expected_mode, value_set, expected_set))
+    if mismatches:
+        raise AssertionError("Python functions differ from the expected values:\n" + '\n'.join(mismatches))
+
+
+def check_parity(spark, num_rows=1000):
+    """Check that the SQL and pandas versions return the same values as the Python functions.
+
+    Raises AssertionError listing the rows that differ.
+    """
+    check_python()
+    register_udfs(spark)
+    lists = [l for l, _, _ in EDGE_CASES] + _fixture_lists(num_rows)
+    spark.createDataFrame([(i, l) for i, l in enumerate(lists)], 'id INT, vals ARRAY<STRING>').createOrReplaceTempView('se_udfs_fixture')
+    result = spark.sql("""
+    SELECT
+      id,
+      {0} AS mode_sql,
+      MODE(vals) AS mode_pandas,
+      {1} AS set_sql,
+      LIST_TO_SET(vals) AS set_pandas
+    FROM se_udfs_fixture
+    """.format(mode_sql('vals'), list_to_set_sql('vals'))).collect()
+
+    mismatches = []
+    for row in result:
+        expected_mode = mode(lists[row['id']])
+        expected_set = list_to_set(lists[row['id']])
+        expected_set = None if expected_set is None else set(expected_set)
+        set_sql = None if row['set_sql'] is None else set(row['set_sql'])
+        set_pandas = None if row['set_pandas'] is None else set(row['set_pandas'])
+        if (row['mode_sql'] != expected_mode or row['mode_pandas'] != expected_mode
+                or set_sql != expected_set or set_pandas != expected_set):
+            mismatches.append("{0}: {1}".format(lists[row['id']], row))
+    if len(result) != len(lists):
+        mismatches.append("{0} rows returned for {1} lists".format(len(result), len(lists)))
+    if mismatches:
+        raise AssertionError("{0} rows differ from the Python implementations:\n{1}".format(
+            len(mismatches), '\n'.join(mismatches)))
+    print("{0} / {1} rows matched".format(len(result), len(lists)))
+
+
+def benchmark(spark, num_rows=200000):
+    """Compare plain Python UDFs, pandas UDFs, and built-in SQL expressions on the same data."""
+    lists = _fixture_lists(num_rows)
+    spark.createDataFrame([(l,) for l in lists], 'vals ARRAY<STRING>').cache().createOrReplaceTempView('se_udfs_bench')
+    spark.sql('SELECT COUNT(1) FROM se_udfs_bench').collect()  # materialize cache
+
+    spark.udf.register('mode_py', mode, 'string')
+    spark.udf.register('list_to_set_py', list_to_set, 'ARRAY<STRING>')
+    register_udfs(spark)
+    variants = [('python udf', 'MODE_PY(vals)', 'LIST_TO_SET_PY(vals)'),
+                ('pandas udf', 'MODE(vals)', 'LIST_TO_SET(vals)'),
+                ('built-in sql', mode_sql('vals'), list_to_set_sql('vals'))]
+    for label, mode_expr, set_expr in variants:
+        start_time = time.time()
+        spark.sql("SELECT SUM(LENGTH({0})), SUM(SIZE({1})) FROM se_udfs_bench".format(mode_expr, set_expr)).collect()
+        print("{0}: {1:.2f} seconds for {2} rows".format(label, time.time() - start_time, num_rows))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_rows", default=200000, type=int,
+                        help="Number of lists to use for the benchmark.")
+    args = parser.parse_args()
+
+    from pyspark.sql import SparkSession
+    spark = SparkSession.builder.master('local[2]').appName('se_udfs').getOrCreate()
+    try:
+        check_parity(spark)
+    except AssertionError as e:
+        raise SystemExit(str(e))
+    benchmark(spark, args.num_rows)
+
+
+if __name__ == "__main__":
+    main()
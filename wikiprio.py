@@ -0,0 +1,136 @@
+"""Single entry point for the analysis scripts.
+
+    python wikiprio.py gather --help
+    python wikiprio.py analyze --input_fn articles.json.bz2 --reports topic_ambiguity
+    python wikiprio.py se-captions --num_calls 5 --api_base http://localhost:8080
+    python wikiprio.py bench-imports
+
+Only the module for the chosen subcommand is imported, and the scripts themselves defer their heavy dependencies
+(pandas, numpy, yaml, requests, mwapi) to the functions that use them, so `--help` and argument errors return
+without loading any of them. `bench-imports` measures that startup overhead so it stays low.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+COMMANDS = {'gather': ('wikiproject_importance', 'gather_wikiprojects_per_article_pageassessments'),
+            'analyze': ('wikiproject_importance', 'wikiproject_importance_analysis'),
+            'se-descriptions': (os.path.join('recommendation_evaluation', 'suggested_edits'), 'SE_wikidatadescriptions'),
+            'se-captions': (os.path.join('recommendation_evaluation', 'suggested_edits'), 'SE_imagecaptions')}
+HEAVY_MODULES = ['pandas', 'numpy', 'yaml', 'requests', 'mwapi', 'mwparserfromhell', 'pyspark']
+
+
+def load_command(command):
+    """Import the script behind a subcommand (its directory goes on sys.path for its sibling imports)."""
+    directory, module = COMMANDS[command]
+    path = os.path.join(ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return __import__(module)
+
+
+def run_command(command, argv):
+    module = load_command(command)
+    sys.argv[0] = 'wikiprio.py {0}'.format(command)  # so usage / errors name the subcommand
+    return module.main(argv)
+
+
+def import_times(command, python=sys.executable):
+    """Import times for a subcommand's script (or a bare interpreter if `command` is None), from `python -X importtime`.
+
+    Returns ({module: cumulative microseconds} for the script and what it imports directly, set of every top-level
+    package loaded along the way). Modules the interpreter loads at startup (site, .pth hooks) are left out.
+    """
+    if command is None:
+        code, env = 'pass', None
+    else:
+        directory, module = COMMANDS[command]
+        code, env = 'import {0}'.format(module), dict(os.environ, PYTHONPATH=os.path.join(ROOT, directory))
+    result = subprocess.run([python, '-X', 'importtime', '-c', code],
+                            env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True, check=True)
+    startup = set() if command is None else set(import_times(None, python)[0])
+    times = {}
+    loaded = set()
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)', line)
+        if not match:
+            continue
+        name = match.group(3)
+        if name in startup:
+            continue
+        loaded.add(name.split('.')[0])
+        if len(match.group(2)) <= 3:  # one space for the script, two more per level of nesting
+            times[name] = int(match.group(1))
+    return times, loaded
+
+
+def help_time(command, runs=5, python=sys.executable):
+    """Median wall-clock seconds of `wikiprio.py <command> --help`, interpreter startup included."""
+    elapsed = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run([python, os.path.join(ROOT, 'wikiprio.py'), command, '--help'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        elapsed.append(time.perf_counter() - start_time)
+    return statistics.median(elapsed)
+
+
+def help_time_baseline(runs=5, python=sys.executable):
+    """Median wall-clock seconds of starting (and exiting) the interpreter, to subtract from help_time."""
+    elapsed = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run([python, '-c', 'pass'], check=True)
+        elapsed.append(time.perf_counter() - start_time)
+    return statistics.median(elapsed)
+
+
+def bench_imports(argv=None):
+    parser = argparse.ArgumentParser(prog='wikiprio.py bench-imports')
+    parser.add_argument("--commands", nargs='*', default=sorted(COMMANDS), choices=sorted(COMMANDS))
+    parser.add_argument("--runs", default=5, type=int,
+                        help="Number of `--help` invocations per subcommand to take the median of.")
+    parser.add_argument("--top", default=5, type=int,
+                        help="Number of slowest imports to list per subcommand.")
+    parser.add_argument("--max_ms", type=float,
+                        help="Exit with an error if any subcommand's `--help` takes longer than this.")
+    args = parser.parse_args(argv)
+
+    baseline = help_time_baseline(args.runs)
+    print("Bare interpreter startup: {0:.1f} ms".format(1000 * baseline))
+    too_slow = []
+    for command in args.commands:
+        times, loaded = import_times(command)
+        module = COMMANDS[command][1]
+        wall = help_time(command, args.runs)
+        heavy = sorted(m for m in HEAVY_MODULES if m in loaded)
+        print("{0}: `--help` {1:.1f} ms (+{2:.1f} ms over bare startup); importing {3} takes {4:.1f} ms".format(
+            command, 1000 * wall, 1000 * (wall - baseline), module, times.get(module, 0) / 1000))
+        print("\theavy dependencies loaded at import: {0}".format(', '.join(heavy) if heavy else 'none'))
+        for m in sorted((m for m in times if m != module), key=times.get, reverse=True)[:args.top]:
+            print("\t{0}: {1:.1f} ms".format(m, times[m] / 1000))
+        if args.max_ms is not None and 1000 * wall > args.max_ms:
+            too_slow.append(command)
+    if too_slow:
+        sys.exit("`--help` slower than {0} ms for: {1}".format(args.max_ms, ', '.join(too_slow)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='wikiprio.py', description=__doc__.split('\n')[0])
+    parser.add_argument("command", choices=sorted(COMMANDS) + ['bench-imports'],
+                        help="Script to run -- remaining arguments are passed to it (e.g., `gather --help`).")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench-imports':
+        return bench_imports(args.args)
+    return run_command(args.command, args.args)
+
+
+if __name__ == "__main__":
+    main()
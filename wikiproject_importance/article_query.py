@@ -0,0 +1,331 @@
+import argparse
+from array import array
+import bz2
+import json
+import os
+import pickle
+import random
+import re
+import time
+import zlib
+
+import article_store
+import topic_bitmask
+from wikiproject_importance_analysis import IMPORTANCE_CATEGORIES, REMOVE, STANDARDIZE, importance_category
+
+# Each field maps article values to a bitmap over article rows (row = position in the gather output file).
+# Bitmaps are stored zlib-compressed and held in memory as Python ints so AND / OR / NOT are single big-int operations.
+# For framed files (see article_store.py) the page ID of each row is stored too so samples are read by random access.
+FIELDS = ['topic', 'wikiproject', 'importance', 'quality', 'wiki', 'ambiguity']
+ANY = '*'  # field:* -- articles with any value for the field
+INDEX_VERSION = 3
+
+
+def article_terms(article_json, vocab=None):
+    """(field, value) pairs that an article from the gather output is indexed under."""
+    topics = article_json['topics']
+    if vocab is not None:
+        topics = topic_bitmask.decode(topics, vocab)
+    for t in topics:
+        yield 'topic', t
+    for wp in article_json['wp_templates']:
+        yield 'wikiproject', wp
+    assessments = [STANDARDIZE[a] for a in article_json['importance'] if a not in REMOVE]
+    for level in set(assessments):
+        yield 'importance', level
+    for q in article_json.get('quality', []):
+        if q not in REMOVE:
+            yield 'quality', q
+    for wiki_db in article_json.get('sitelinks', {}):
+        yield 'wiki', wiki_db
+    yield 'ambiguity', IMPORTANCE_CATEGORIES[importance_category(assessments)]
+
+
+def source_stat(input_json):
+    """Size and modification time of a gather output file -- an index is rebuilt when these change."""
+    stat = os.stat(input_json)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _to_bitmap(rows, num_rows):
+    bits = bytearray((num_rows + 7) // 8)
+    for r in rows:
+        bits[r >> 3] |= 1 << (r & 7)
+    return bytes(bits)
+
+
+def build_index(input_json, index_fn, verbose=True):
+    """Scan a gather output file once and write compressed field:value -> articles bitmaps to `index_fn`."""
+    start_time = time.time()
+    stat = source_stat(input_json)
+    vocab = topic_bitmask.read_vocabulary(input_json)
+    postings = {f: {ANY: array('I')} for f in FIELDS}  # field -> value -> rows
+    num_rows = 0
+    with bz2.open(input_json, 'rt') as fin:
+        for row, line in enumerate(fin):
+            article_json = json.loads(line)
+            fields = set()
+            for field, value in article_terms(article_json, vocab):
+                postings[field].setdefault(value, array('I')).append(row)
+                fields.add(field)
+            for field in fields:
+                postings[field][ANY].append(row)
+            num_rows = row + 1
+            if num_rows % 500000 == 0 and verbose:
+                print("{0} items indexed".format(num_rows))
+
+    row_pids = None
+    if os.path.exists(article_store.index_fn(input_json)):
+        with article_store.ArticleStore(input_json) as store:
+            row_pids = store.row_page_ids()
+        if len(row_pids) != num_rows:
+            raise ValueError("{0} does not match {1} -- regenerate the file.".format(
+                article_store.index_fn(input_json), input_json))
+
+    compressed = {f: {v: zlib.compress(_to_bitmap(rows, num_rows)) for v, rows in postings[f].items()} for f in FIELDS}
+    counts = {f: {v: len(rows) for v, rows in postings[f].items() if v != ANY} for f in FIELDS}
+    with open(index_fn, 'wb') as fout:
+        pickle.dump({'version': INDEX_VERSION, 'source': os.path.abspath(input_json), 'source_stat': stat,
+                     'num_rows': num_rows, 'row_pids': row_pids, 'counts': counts, 'postings': compressed},
+                    fout, protocol=pickle.HIGHEST_PROTOCOL)
+    if verbose:
+        print("Indexed {0} articles / {1} terms to {2} in {3:.1f} minutes.".format(
+            num_rows, sum(len(v) for v in compressed.values()), index_fn, (time.time() - start_time) / 60))
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+TOKEN_RE = re.compile(r'\s*(\(|\)|\w+:"[^"]*"|[^\s()]+)')
+
+
+class ArticleIndex:
+    """Boolean queries over the gathered WikiProject dataset.
+
+    Terms are field:value (quote values with spaces) or field:* for any value, combined with AND, OR, NOT and
+    parentheses. Adjacent terms are ANDed. E.g.:
+        topic:STEM.Biology importance:Top ambiguity:full
+        wiki:enwiki AND NOT topic:*
+        wikiproject:"Video games" AND (quality:FA OR quality:GA)
+    """
+
+    def __init__(self, index_fn):
+        with open(index_fn, 'rb') as fin:
+            index = pickle.load(fin)
+        if index['version'] != INDEX_VERSION:
+            raise ValueError("Index at {0} is outdated -- rebuild it.".format(index_fn))
+        self.source = index['source']
+        self.source_stat = index['source_stat']
+        self.num_rows = index['num_rows']
+        self.row_pids = index['row_pids']
+        self._counts = index['counts']
+        self._postings = index['postings']
+        self._bitmaps = {}
+        self._all = (1 << self.num_rows) - 1
+
+    def values(self, field):
+        """All indexed values of a field with their article counts."""
+        return dict(self._counts[field])
+
+    def bitmap(self, field, value):
+        """Articles (as an int bitmap) that have `value` for `field`. '*' matches any value."""
+        if field not in self._postings:
+            raise QuerySyntaxError("Unknown field '{0}' -- expected one of {1}".format(field, FIELDS))
+        if value not in self._postings[field]:
+            return 0
+        key = (field, value)
+        if key not in self._bitmaps:
+            self._bitmaps[key] = int.from_bytes(zlib.decompress(self._postings[field][value]), 'little')
+        return self._bitmaps[key]
+
+    def query(self, q):
+        """Evaluate a query string to an int bitmap over article rows."""
+        tokens = TOKEN_RE.findall(q)
+        bitmap, pos = self._parse_or(tokens, 0)
+        if pos != len(tokens):
+            raise QuerySyntaxError("Unexpected '{0}' in query: {1}".format(tokens[pos], q))
+        return bitmap
+
+    def _parse_or(self, tokens, pos):
+        bitmap, pos = self._parse_and(tokens, pos)
+        while pos < len(tokens) and tokens[pos].upper() == 'OR':
+            rhs, pos = self._parse_and(tokens, pos + 1)
+            bitmap |= rhs
+        return bitmap, pos
+
+    def _parse_and(self, tokens, pos):
+        bitmap, pos = self._parse_not(tokens, pos)
+        while pos < len(tokens) and tokens[pos] != ')' and tokens[pos].upper() != 'OR':
+            if tokens[pos].upper() == 'AND':
+                pos += 1
+            rhs, pos = self._parse_not(tokens, pos)
+            bitmap &= rhs
+        return bitmap, pos
+
+    def _parse_not(self, tokens, pos):
+        if pos < len(tokens) and tokens[pos].upper() == 'NOT':
+            bitmap, pos = self._parse_not(tokens, pos + 1)
+            return self._all ^ bitmap, pos
+        return self._parse_term(tokens, pos)
+
+    def _parse_term(self, tokens, pos):
+        if pos == len(tokens):
+            raise QuerySyntaxError("Query ended unexpectedly")
+        token = tokens[pos]
+        if token == '(':
+            bitmap, pos = self._parse_or(tokens, pos + 1)
+            if pos == len(tokens) or tokens[pos] != ')':
+                raise QuerySyntaxError("Missing ')'")
+            return bitmap, pos + 1
+        field, value = self._split_term(token)
+        return self.bitmap(field, value), pos + 1
+
+    @staticmethod
+    def _split_term(token):
+        if ':' not in token:
+            raise QuerySyntaxError("Expected field:value but got '{0}'".format(token))
+        field, value = token.split(':', 1)
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        return field, value
+
+    def unknown_terms(self, q):
+        """field:value terms of a query whose value never occurs in the data (and so match no articles)."""
+        unknown = []
+        for token in TOKEN_RE.findall(q):
+            if ':' in token:
+                field, value = self._split_term(token)
+                if field in self._postings and value not in self._postings[field]:
+                    unknown.append(token)
+        return unknown
+
+    @staticmethod
+    def count_bitmap(bitmap):
+        return bin(bitmap).count('1')
+
+    @staticmethod
+    def rows(bitmap):
+        """Iterate over the article rows in a bitmap in order."""
+        data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+        for i, byte in enumerate(data):
+            while byte:
+                low = byte & -byte
+                yield i * 8 + low.bit_length() - 1
+                byte ^= low
+
+    def count(self, q):
+        """Number of articles matching a query."""
+        return self.count_bitmap(self.query(q))
+
+    def sample(self, q, n=10, seed=None):
+        """Rows of up to n matching articles -- the first n or a random sample if a seed is given."""
+        bitmap = self.query(q)
+        if seed is None:
+            rows = []
+            for r in self.rows(bitmap):
+                if len(rows) == n:
+                    break
+                rows.append(r)
+            return rows
+        rows = list(self.rows(bitmap))
+        return sorted(random.Random(seed).sample(rows, min(n, len(rows))))
+
+
+def load_or_build(input_json, index_fn, verbose=True):
+    """ArticleIndex for `input_json`, (re)built if the index is missing, outdated or from an earlier version of the file."""
+    index = None
+    if os.path.exists(index_fn):
+        try:
+            index = ArticleIndex(index_fn)
+        except ValueError:
+            pass  # built by an older version of this script
+    input_json = input_json or (index.source if index is not None else None)
+    if input_json is None:
+        raise ValueError("{0} is missing or outdated and there is no gather output to build it from.".format(index_fn))
+    if index is not None and index.source_stat == source_stat(input_json):
+        return index
+    if os.path.exists(index_fn) and verbose:
+        print("{0} is outdated or does not match {1} -- rebuilding.".format(index_fn, input_json))
+    build_index(input_json, index_fn, verbose)
+    return ArticleIndex(index_fn)
+
+
+def read_articles(index, input_json, rows):
+    """(row, article) for the given rows -- by random access if the file is framed, else by scanning it."""
+    if index.row_pids is None or not os.path.exists(article_store.index_fn(input_json)):
+        yield from read_rows(input_json, rows)
+        return
+    vocab = topic_bitmask.read_vocabulary(input_json)
+    pid_to_row = {index.row_pids[r]: r for r in rows}
+    with article_store.ArticleStore(input_json) as store:
+        articles = {pid_to_row[pid]: article_json for pid, article_json in store.lookup_many(pid_to_row)}
+    for row in sorted(articles):
+        if vocab is not None:
+            articles[row]['topics'] = topic_bitmask.decode(articles[row]['topics'], vocab)
+        yield row, articles[row]
+
+
+def read_rows(input_json, rows):
+    """Articles at the given rows of an unframed gather output file (one scan, stops after the last row).
+
+    Bitmask-encoded topics are decoded to names.
+    """
+    vocab = topic_bitmask.read_vocabulary(input_json)
+    wanted = set(rows)
+    last = max(wanted, default=-1)
+    with bz2.open(input_json, 'rt') as fin:
+        for row, line in enumerate(fin):
+            if row > last:
+                break
+            if row in wanted:
+                article_json = json.loads(line)
+                if vocab is not None:
+                    article_json['topics'] = topic_bitmask.decode(article_json['topics'], vocab)
+                yield row, article_json
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_json",
+                        help="Bzipped JSON file from gather_wikiprojects_per_article_pageassessments.py.")
+    parser.add_argument("--index_fn",
+                        help="Where the postings are stored. Defaults to <input_json>.postings and is (re)built if "
+                             "missing or older than --input_json.")
+    parser.add_argument("--query", nargs='*', default=[],
+                        help='Queries like \'topic:STEM.Biology importance:Top ambiguity:full\' or \'wiki:enwiki AND NOT topic:*\'.')
+    parser.add_argument("--values",
+                        choices=FIELDS,
+                        help="List all values of a field with article counts.")
+    parser.add_argument("--sample", default=0, type=int,
+                        help="Print this many matching articles for each query.")
+    parser.add_argument("--seed", type=int,
+                        help="Random seed for sampling (default: first matching articles).")
+    args = parser.parse_args()
+
+    index_fn = args.index_fn or args.input_json + '.postings'
+    index = load_or_build(args.input_json, index_fn)
+
+    if args.values:
+        values = index.values(args.values)
+        for v in sorted(values, key=values.get, reverse=True):
+            print("{0}\t{1}".format(v, values[v]))
+
+    for q in args.query:
+        start_time = time.time()
+        try:
+            count = index.count(q)
+        except QuerySyntaxError as e:
+            parser.error("{0}: {1}".format(q, e))
+        print("{0}: {1} articles ({2:.1f}%) in {3:.3f} seconds".format(
+            q, count, 100 * count / max(index.num_rows, 1), time.time() - start_time))
+        for term in index.unknown_terms(q):
+            print("\tno articles have {0} -- see --values for the values that occur".format(term))
+        if args.sample:
+            rows = index.sample(q, args.sample, args.seed)
+            for row, article_json in read_articles(index, args.input_json or index.source, rows):
+                print("\t{0}: {1}".format(row, json.dumps(article_json)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+from array import array
+from bisect import bisect_left
+import bz2
+from functools import lru_cache
+import json
+import mmap
+import os
+import shutil
+import sys
+
+from sitelinks_index import qid_to_int
+
+# A framed file is a series of independent bzip2 streams ("frames") of up to `frame_size` JSON lines each. Concatenated
+# bzip2 streams are still a valid .bz2 file so bz2.open / bzcat / complex() read it as usual. The sidecar index
+# (<fn>.idx) maps page IDs and QIDs to (frame, row) so single articles can be read by decompressing one frame.
+#   header line (JSON, padded to a multiple of 8 bytes) with the data file's size and the layout of the arrays below,
+#   then the arrays themselves:
+#   frame_offsets: uint64 [num_frames + 1] -- byte offset of each frame in the data file
+#   pids / pid_frames / pid_rows: uint32 -- sorted page IDs and the frame + row within the frame of each article
+#   qids / qid_entries: uint32 -- sorted QIDs (as ints) and the position of their article in `pids`
+INDEX_VERSION = 2
+DEFAULT_FRAME_SIZE = 1000
+
+
+def index_fn(fn):
+    """Sidecar index file of a framed article file."""
+    return fn + '.idx'
+
+
+def _write_index(fn, frame_offsets, pids, frames, rows, qids):
+    """Sort the (pid, frame, row, qid) entries and write them as the sidecar index of `fn`."""
+    order = sorted(range(len(pids)), key=pids.__getitem__)
+    arrays = {'frame_offsets': frame_offsets,
+              'pids': array('I', (pids[i] for i in order)),
+              'pid_frames': array('I', (frames[i] for i in order)),
+              'pid_rows': array('I', (rows[i] for i in order))}
+    qid_order = sorted((e for e, i in enumerate(order) if qids[i]), key=lambda e: qids[order[e]])
+    arrays['qids'] = array('I', (qids[order[e]] for e in qid_order))
+    arrays['qid_entries'] = array('I', qid_order)
+
+    layout = {}
+    offset = 0
+    for name, values in arrays.items():
+        layout[name] = [values.typecode, offset, len(values)]
+        offset += len(values) * values.itemsize
+    header = json.dumps({'version': INDEX_VERSION, 'byteorder': sys.byteorder, 'data_bytes': frame_offsets[-1],
+                         'arrays': layout})
+    header = header.ljust((len(header) + 1 + 7) // 8 * 8 - 1) + '\n'
+    with open(index_fn(fn), 'wb') as fout:
+        fout.write(header.encode('ascii'))
+        for values in arrays.values():
+            values.tofile(fout)
+
+
+def _read_index_arrays(fn):
+    """Read a sidecar index into (non-mmapped) arrays -- used for merging shards."""
+    with open(index_fn(fn), 'rb') as fin:
+        header = json.loads(fin.readline())
+        arrays = {}
+        for name, (typecode, _, length) in header['arrays'].items():
+            arrays[name] = array(typecode)
+            arrays[name].fromfile(fin, length)
+    return arrays
+
+
+class FramedWriter:
+    """Write articles as independently compressed bzip2 frames + a page ID / QID index.
+
+    Usage:
+        with FramedWriter('articles.json.bz2') as fout:
+            fout.write(pid, json.dumps(article) + '\n', article.get('qid'))
+    """
+
+    def __init__(self, fn, frame_size=DEFAULT_FRAME_SIZE):
+        self.fn = fn
+        self.frame_size = frame_size
+        self._fout = open(fn, 'wb')
+        self._buffer = []
+        self.frame_offsets = array('Q', [0])
+        self.pids = array('I')
+        self.frames = array('I')
+        self.rows = array('I')
+        self.qids = array('I')
+
+    def write(self, pid, line, qid=None):
+        self.pids.append(pid)
+        self.frames.append(len(self.frame_offsets) - 1)
+        self.rows.append(len(self._buffer))
+        self.qids.append(qid_to_int(qid) if qid else 0)
+        self._buffer.append(line)
+        if len(self._buffer) == self.frame_size:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._fout.write(bz2.compress(''.join(self._buffer).encode('utf-8')))
+            self.frame_offsets.append(self._fout.tell())
+            self._buffer = []
+
+    def close(self):
+        self._flush()
+        self._fout.close()
+        _write_index(self.fn, self.frame_offsets, self.pids, self.frames, self.rows, self.qids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def concatenate(output_fn, part_fns):
+    """Concatenate bzipped part files into `output_fn` (and delete them), merging their indexes if they are framed."""
+    framed = all(os.path.exists(index_fn(fn)) for fn in part_fns)
+    frame_offsets = array('Q', [0])
+    pids, frames, rows, qids = array('I'), array('I'), array('I'), array('I')
+    with open(output_fn, 'wb') as fout:
+        for fn in part_fns:
+            byte_shift = fout.tell()
+            with open(fn, 'rb') as fin:
+                shutil.copyfileobj(fin, fout)
+            os.remove(fn)
+            if framed:
+                part = _read_index_arrays(fn)
+                os.remove(index_fn(fn))
+                frame_shift = len(frame_offsets) - 1
+                frame_offsets.extend(o + byte_shift for o in part['frame_offsets'][1:])
+                pids.extend(part['pids'])
+                frames.extend(f + frame_shift for f in part['pid_frames'])
+                rows.extend(part['pid_rows'])
+                part_qids = array('I', bytes(4 * len(part['pids'])))
+                for q, e in zip(part['qids'], part['qid_entries']):
+                    part_qids[e] = q
+                qids.extend(part_qids)
+    if framed:
+        _write_index(output_fn, frame_offsets, pids, frames, rows, qids)
+    elif os.path.exists(index_fn(output_fn)):
+        os.remove(index_fn(output_fn))  # stale index from an earlier framed run
+
+
+class ArticleStore:
+    """Random access to articles in a framed gather output file by page ID or QID.
+
+    Only the frames holding the requested articles are read and decompressed; recently used frames are cached.
+    """
+
+    def __init__(self, fn, cached_frames=64):
+        self.fn = fn
+        with open(index_fn(fn), 'rb') as fin:
+            header = json.loads(fin.readline())
+            if header['version'] != INDEX_VERSION or header['byteorder'] != sys.byteorder:
+                raise ValueError("Index for {0} is incompatible -- regenerate the file.".format(fn))
+            if header['data_bytes'] != os.path.getsize(fn):
+                raise ValueError("Index for {0} does not match the file (was it rewritten without --frame_size?) "
+                                 "-- regenerate the file.".format(fn))
+            data_start = fin.tell()
+            self._mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        for name, (typecode, offset, length) in header['arrays'].items():
+            start = data_start + offset
+            view = memoryview(self._mm)[start:start + length * array(typecode).itemsize].cast(typecode)
+            self._views.append(view)
+            setattr(self, '_' + name, view)
+        self._data = open(fn, 'rb')
+        self._frame = lru_cache(maxsize=cached_frames)(self._read_frame)
+
+    def __len__(self):
+        return len(self._pids)
+
+    def _read_frame(self, frame):
+        start, end = self._frame_offsets[frame], self._frame_offsets[frame + 1]
+        self._data.seek(start)
+        return bz2.decompress(self._data.read(end - start)).decode('utf-8').splitlines()
+
+    def _article(self, entry):
+        article = json.loads(self._frame(self._pid_frames[entry])[self._pid_rows[entry]])
+        return self._pids[entry], article
+
+    def _pid_entry(self, pid):
+        i = bisect_left(self._pids, pid)
+        if i < len(self._pids) and self._pids[i] == pid:
+            return i
+        return None
+
+    def _qid_entry(self, qid):
+        q = qid_to_int(qid) if isinstance(qid, str) else qid
+        i = bisect_left(self._qids, q)
+        if i < len(self._qids) and self._qids[i] == q:
+            return self._qid_entries[i]
+        return None
+
+    def row_page_ids(self):
+        """Page ID of every article in file order (position = line in the decompressed file)."""
+        frame_starts = array('I', bytes(4 * len(self._frame_offsets)))
+        for f in self._pid_frames:
+            frame_starts[f + 1] += 1
+        for f in range(1, len(frame_starts)):
+            frame_starts[f] += frame_starts[f - 1]
+        row_pids = array('I', bytes(4 * len(self._pids)))
+        for pid, f, r in zip(self._pids, self._pid_frames, self._pid_rows):
+            row_pids[frame_starts[f] + r] = pid
+        return row_pids
+
+    def lookup(self, pid):
+        """Article JSON for a page ID or None."""
+        entry = self._pid_entry(pid)
+        return None if entry is None else self._article(entry)[1]
+
+    def lookup_qid(self, qid):
+        """(page ID, article JSON) for a QID or (None, None)."""
+        entry = self._qid_entry(qid)
+        return (None, None) if entry is None else self._article(entry)
+
+    def lookup_many(self, pids=(), qids=()):
+        """Yield (page ID, article JSON) for many page IDs / QIDs, reading each frame only once. Misses are skipped."""
+        entries = set(self._pid_entry(pid) for pid in pids)
+        entries.update(self._qid_entry(qid) for qid in qids)
+        entries.discard(None)
+        for entry in sorted(entries, key=lambda e: (self._pid_frames[e], self._pid_rows[e])):
+            yield self._article(entry)
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._mm.close()
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_json",
+                        help="Framed bzipped JSON file written by gather_wikiprojects_per_article_pageassessments.py --frame_size.")
+    parser.add_argument("--pids", nargs='*', type=int, default=[],
+                        help="Page IDs to look up.")
+    parser.add_argument("--qids", nargs='*', default=[],
+                        help="QIDs to look up.")
+    parser.add_argument("--ids_file",
+                        help="File with one page ID or QID per line to look up.")
+    args = parser.parse_args()
+
+    pids = list(args.pids)
+    qids = list(args.qids)
+    if args.ids_file:
+        with open(args.ids_file, 'r') as fin:
+            for line in fin:
+                key = line.strip()
+                if key.startswith('Q'):
+                    qids.append(key)
+                elif key:
+                    pids.append(int(key))
+
+    with ArticleStore(args.input_json) as store:
+        found = 0
+        for pid, article in store.lookup_many(pids, qids):
+            found += 1
+            print(json.dumps({'article_pid': pid, **article}))
+    print("{0} of {1} articles found.".format(found, len(pids) + len(qids)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
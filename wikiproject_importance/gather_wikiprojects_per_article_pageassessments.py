@@ -3,12 +3,15 @@ import bz2
 from collections import defaultdict
 import csv
 import json
+import multiprocessing
 import os
 import re
 import time
-import yaml
 
-import requests
+import article_store
+from sitelinks_index import SitelinksIndex, build_index, is_current
+from taxonomy_cache import load_or_compile
+import topic_bitmask
 
 def exec_mariadb_stat2(query, db, filename=None, verbose=True):
     """Query MariaDB."""
@@ -108,6 +111,32 @@ def _invert_wp_taxonomy(wp_taxonomy, path=None):
         for wikiproject_name in catch_all_wikiprojects:
             yield wikiproject_name, ".".join(catch_all)
 
+def compile_taxonomy(topics_yaml, wikiprojects_sitelinks_json=None):
+    """Parse and normalize the WikiProject taxonomy and cross-language WikiProject mapping.
+
+    Returns the topic vocabulary, normalized WikiProject -> topic IDs, and for each non-English wiki in DB_METADATA
+    the normalized local WikiProject name -> English WikiProject name.
+    """
+    import yaml
+
+    with open(topics_yaml, 'r') as fin:
+        taxonomy = yaml.safe_load(fin)
+    wp_to_labels = generate_wp_to_labels(taxonomy)
+    topics = sorted(set(t for labels in wp_to_labels.values() for t in labels))
+    topic_ids = {t:i for i, t in enumerate(topics)}
+    wp_to_topic_ids = {wp:tuple(sorted(topic_ids[t] for t in labels)) for wp, labels in wp_to_labels.items()}
+
+    db_to_enwiki = {db:{} for db in DB_METADATA if db != 'enwiki'}
+    if wikiprojects_sitelinks_json and os.path.exists(wikiprojects_sitelinks_json):
+        with open(wikiprojects_sitelinks_json, 'r') as fin:
+            for line in fin:
+                lj = json.loads(line)
+                if 'enwiki' in lj['sitelinks']:
+                    for db in db_to_enwiki:
+                        if db in lj['sitelinks']:
+                            db_to_enwiki[db][DB_METADATA[db]['norm'](lj['sitelinks'][db])] = lj['sitelinks']['enwiki']
+    return {'topics':topics, 'wp_to_topic_ids':wp_to_topic_ids, 'db_to_enwiki':db_to_enwiki}
+
 def get_topics(wikiprojects, topics_taxonomy, topic_counts):
     """Map WikiProject labels to topics. Track statistics."""
     topics = set()
@@ -130,6 +159,7 @@ def chunk(pageids, batch_size=50):
 
 def get_sitelinks_wikiprojects(output_json):
     """Mapping of WikiProjects across languages."""
+    import requests
 
     # SPARQL endpoint
     all_wikiprojects_query = "https://query.wikidata.org/sparql?query=%23WikiProjects%0ASELECT%20%3Fitem%20%3FitemLabel%20%0AWHERE%20%0A%7B%0A%20%20%3Fitem%20wdt%3AP31%20wd%3AQ21025364.%0A%20%20SERVICE%20wikibase%3Alabel%20%7B%20bd%3AserviceParam%20wikibase%3Alanguage%20%22%5BAUTO_LANGUAGE%5D%2Cen%22.%20%7D%0A%7D&format=json"
@@ -166,7 +196,78 @@ def get_sitelinks_wikiprojects(output_json):
             fout.write(json.dumps(sitelinks[qid]) + '\n')
 
 
-def main():
+def write_articles(output_fn, pids, pids_to_metadata, db, wikiproject_to_topic, db_to_enwiki=None, topic_ids=None,
+                   frame_size=0):
+    """Write article metadata + inferred topics for `pids` to bzipped JSON. Returns WikiProject counts and topic distribution.
+
+    With `frame_size`, articles are written in independently compressed frames with a page ID / QID index (see article_store.py).
+    """
+    norm_fn = DB_METADATA[db]['norm']
+    topic_counts = {}
+    topic_dist = {}
+    if frame_size:
+        fout = article_store.FramedWriter(output_fn, frame_size)
+    else:
+        if os.path.exists(article_store.index_fn(output_fn)):
+            os.remove(article_store.index_fn(output_fn))  # stale index from an earlier framed run
+        fout = bz2.open(output_fn, 'wt')
+    with fout:
+        for pid in pids:
+            wp_templates = pids_to_metadata[pid]['wp_templates']
+            if db != 'enwiki':
+                wp_templates = [db_to_enwiki[norm_fn(t)] for t in wp_templates if norm_fn(t) in db_to_enwiki]
+            topics = get_topics(wp_templates, wikiproject_to_topic, topic_counts)
+            topic_dist[len(topics)] = topic_dist.get(len(topics), 0) + 1
+            output_json = pids_to_metadata[pid].copy()
+            if topic_ids is not None:
+                output_json['topics'] = topic_bitmask.encode(topics, topic_ids)
+            else:
+                output_json['topics'] = topics
+            if frame_size:
+                fout.write(pid, json.dumps(output_json) + "\n", output_json.get('qid'))
+            else:
+                fout.write(json.dumps(output_json) + "\n")
+    return topic_counts, topic_dist
+
+# lookup tables for pool workers -- set before forking so workers share them copy-on-write instead of pickling them
+_SHARD_TABLES = {}
+
+def _write_shard(shard):
+    """Pool worker: write the articles in one page ID range."""
+    shard_fn, start, end = shard
+    tables = _SHARD_TABLES.copy()
+    pids = tables.pop('pids')[start:end]
+    return write_articles(shard_fn, pids, **tables)
+
+def write_articles_sharded(output_fn, workers, **tables):
+    """Split articles into `workers` contiguous page ID ranges, write each range in its own process, and combine.
+
+    Each shard is a complete bzip2 stream (or set of frames) so the shards are concatenated into a single multi-stream
+    `output_fn` that bz2.open and bzcat read like any other. Requires the fork start method (Linux).
+    """
+    start_time = time.time()
+    pids = sorted(tables['pids_to_metadata'])
+    bounds = [len(pids) * i // workers for i in range(workers + 1)]
+    shards = [('{0}.shard-{1:03d}'.format(output_fn, i), bounds[i], bounds[i + 1]) for i in range(workers)]
+    _SHARD_TABLES.update(tables, pids=pids)
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            results = pool.map(_write_shard, shards, chunksize=1)
+    finally:
+        _SHARD_TABLES.clear()
+
+    topic_counts = {}
+    topic_dist = {}
+    for shard_topic_counts, shard_topic_dist in results:
+        for wp, count in shard_topic_counts.items():
+            topic_counts[wp] = topic_counts.get(wp, 0) + count
+        for num_topics, count in shard_topic_dist.items():
+            topic_dist[num_topics] = topic_dist.get(num_topics, 0) + count
+    article_store.concatenate(output_fn, [shard_fn for shard_fn, _, _ in shards])
+    print("{0} articles written by {1} workers in {2:.1f} minutes.".format(len(pids), workers, (time.time() - start_time) / 60))
+    return topic_counts, dict(sorted(topic_dist.items()))
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--page_assessments_tsv",
                         default='./page_assessments.tsv',
@@ -180,16 +281,34 @@ def main():
     parser.add_argument("--pid_to_qid_tsv",
                         default="./resources/pid_to_qid.tsv",
                         help="TSV file with full dump of page IDs and QIDs")
+    parser.add_argument("--sitelinks_index",
+                        help="Directory with memory-mapped sitelinks index (see sitelinks_index.py). "
+                             "Built from --pid_to_qid_tsv if missing or older than the TSV; replaces re-parsing the TSV.")
     parser.add_argument("--topics_yaml",
                         default="/home/halfak/projects/drafttopic/datasets/wikiproject_taxonomy.20191212.yaml",
                         help="YAML file with mapping between canonical WikiProject name and associated topics.")
     parser.add_argument("--wikiprojects_sitelinks_json",
                         help="JSON file with mapping between WikiProjects across languages.")
+    parser.add_argument("--taxonomy_cache",
+                        default="./resources/wikiproject_taxonomy.compiled.pkl",
+                        help="Compiled taxonomy / WikiProject translations. Rebuilt when --topics_yaml or --wikiprojects_sitelinks_json change.")
     parser.add_argument("--output_json",
                         help="Bzipped JSON file that will contain article metadata WikiProject templates, and inferred topics.")
-    args = parser.parse_args()
+    parser.add_argument("--workers",
+                        default=1,
+                        type=int,
+                        help="Number of processes that write the output in parallel (split by page ID range).")
+    parser.add_argument("--frame_size",
+                        default=0,
+                        type=int,
+                        help="Write articles in independently compressed frames of this many articles + a page ID / QID index "
+                             "for random access (see article_store.py). 0 writes a single bzip2 stream.")
+    parser.add_argument("--topic_encoding",
+                        default="names",
+                        choices=["names", "bitmask"],
+                        help="Write topics as lists of names or as an integer bitmask over the vocabulary in <output_json>.topics.json.")
+    args = parser.parse_args(argv)
     db = args.page_assessments_db
-    norm_fn = DB_METADATA[db]['norm']
 
     # get mapping of pageID to list of all associated WikiProjects via page_assessments table in MariaDB
     # gathers importance ratings but doesn't track which evaluation came from which WikiProject
@@ -257,71 +376,82 @@ def main():
         exec_hive_stat2(query, filename=args.pid_to_qid_tsv, priority=False, verbose=True, nice=True, large=False)
         print("PID / QID mapping complete after {0:.1f} minutes!".format((time.time() - start_time) / 60))
 
-    qid_to_pids = {}
-    pid_to_qid = {}
-    with open(args.pid_to_qid_tsv, 'r') as fin:
-        tsvreader = csv.reader(fin, delimiter='\t')
-        assert next(tsvreader) == ['item_id', 'page_id', 'wiki_db']
-        for line in tsvreader:
-            wiki_db = line[2]
-            if wiki_db == db:
-                qid = line[0]
-                pid = int(line[1])
-                qid_to_pids[qid] = {}
-                pid_to_qid[pid] = qid
-    print("{0} pages in {1} with Wikidata IDs".format(len(qid_to_pids), db))
-
-    with open(args.pid_to_qid_tsv, 'r') as fin:
-        tsvreader = csv.reader(fin, delimiter='\t')
-        assert next(tsvreader) == ['item_id', 'page_id', 'wiki_db']
-        for line in tsvreader:
-            qid = line[0]
-            if qid in qid_to_pids:
-                pid = int(line[1])
+    if args.sitelinks_index:
+        if not is_current(args.sitelinks_index, args.pid_to_qid_tsv):
+            print("Building sitelinks index (missing or older than {0}) and writing to: {1}".format(
+                args.pid_to_qid_tsv, args.sitelinks_index))
+            build_index(args.pid_to_qid_tsv, args.sitelinks_index)
+        found = 0
+        with SitelinksIndex(args.sitelinks_index) as sitelinks_index:
+            print("{0} pages in {1} with Wikidata IDs".format(sitelinks_index.num_pages(db), db))
+            for pid in pids_to_metadata:
+                qid, sitelinks = sitelinks_index.page_sitelinks(db, pid)
+                if qid is not None:
+                    found += 1
+                    pids_to_metadata[pid]['sitelinks'] = sitelinks
+                    pids_to_metadata[pid]['qid'] = qid
+        print("{0} sitelink sets found out of {1}".format(found, len(pids_to_metadata)))
+    else:
+        qid_to_pids = {}
+        pid_to_qid = {}
+        with open(args.pid_to_qid_tsv, 'r') as fin:
+            tsvreader = csv.reader(fin, delimiter='\t')
+            assert next(tsvreader) == ['item_id', 'page_id', 'wiki_db']
+            for line in tsvreader:
                 wiki_db = line[2]
-                qid_to_pids[qid][wiki_db] = pid
-
-    found = 0
-    for pid in pids_to_metadata:
-        if pid in pid_to_qid:
-            found += 1
-            qid = pid_to_qid[pid]
-            pids_to_metadata[pid]['sitelinks'] = qid_to_pids[qid]
-            pids_to_metadata[pid]['qid'] = qid
-    print("{0} sitelink sets found out of {1}".format(found, len(pids_to_metadata)))
-
-    with open(args.topics_yaml, 'r') as fin:
-        taxonomy = yaml.safe_load(fin)
+                if wiki_db == db:
+                    qid = line[0]
+                    pid = int(line[1])
+                    qid_to_pids[qid] = {}
+                    pid_to_qid[pid] = qid
+        print("{0} pages in {1} with Wikidata IDs".format(len(qid_to_pids), db))
 
-    wikiproject_to_topic = generate_wp_to_labels(taxonomy)
-    topics = set()
-    for wp in wikiproject_to_topic:
-        for topic in wikiproject_to_topic[wp]:
-            topics.add(topic)
+        with open(args.pid_to_qid_tsv, 'r') as fin:
+            tsvreader = csv.reader(fin, delimiter='\t')
+            assert next(tsvreader) == ['item_id', 'page_id', 'wiki_db']
+            for line in tsvreader:
+                qid = line[0]
+                if qid in qid_to_pids:
+                    pid = int(line[1])
+                    wiki_db = line[2]
+                    qid_to_pids[qid][wiki_db] = pid
 
-    if db != 'enwiki':
+        found = 0
+        for pid in pids_to_metadata:
+            if pid in pid_to_qid:
+                found += 1
+                qid = pid_to_qid[pid]
+                pids_to_metadata[pid]['sitelinks'] = qid_to_pids[qid]
+                pids_to_metadata[pid]['qid'] = qid
+        print("{0} sitelink sets found out of {1}".format(found, len(pids_to_metadata)))
+
+    if db != 'enwiki' and not os.path.exists(args.wikiprojects_sitelinks_json):
+        print("Gathering WikiProject sitelinks and writing to:", args.wikiprojects_sitelinks_json)
         get_sitelinks_wikiprojects(args.wikiprojects_sitelinks_json)
-        db_to_enwiki = {}
-        with open(args.wikiprojects_sitelinks_json, 'r') as fin:
-            for line in fin:
-                lj = json.loads(line)
-                if 'enwiki' in lj['sitelinks'] and db in lj['sitelinks']:
-                    db_to_enwiki[norm_fn(lj['sitelinks'][db])] = lj['sitelinks']['enwiki']
+    compiled = load_or_compile(args.taxonomy_cache,
+                               [args.topics_yaml, args.wikiprojects_sitelinks_json],
+                               lambda: compile_taxonomy(args.topics_yaml, args.wikiprojects_sitelinks_json),
+                               extra=sorted(DB_METADATA))
+    topics = compiled['topics']
+    wikiproject_to_topic = {wp:[topics[i] for i in topic_ids] for wp, topic_ids in compiled['wp_to_topic_ids'].items()}
+    if db != 'enwiki':
+        db_to_enwiki = compiled['db_to_enwiki'][db]
     print("{0} WikiProjects and {1} topics".format(len(wikiproject_to_topic), len(topics)))
+    if args.topic_encoding == 'bitmask':
+        topic_ids = topic_bitmask.topic_ids(topics)
+    topic_bitmask.write_vocabulary(args.output_json, topics, encoding=args.topic_encoding)
 
     # dump articles to bzipped JSON with metadata and associated topics
-    topic_counts = {}
-    topic_dist = {}
-    with bz2.open(args.output_json, 'wt') as fout:
-        for pid in pids_to_metadata:
-            wp_templates = pids_to_metadata[pid]['wp_templates']
-            if db != 'enwiki':
-                wp_templates = [db_to_enwiki[norm_fn(t)] for t in wp_templates if norm_fn(t) in db_to_enwiki]
-            topics = get_topics(wp_templates, wikiproject_to_topic, topic_counts)
-            topic_dist[len(topics)] = topic_dist.get(len(topics), 0) + 1
-            output_json = pids_to_metadata[pid].copy()
-            output_json['topics'] = topics
-            fout.write(json.dumps(output_json) + "\n")
+    tables = {'pids_to_metadata':pids_to_metadata,
+              'db':db,
+              'wikiproject_to_topic':wikiproject_to_topic,
+              'db_to_enwiki':db_to_enwiki if db != 'enwiki' else None,
+              'topic_ids':topic_ids if args.topic_encoding == 'bitmask' else None,
+              'frame_size':args.frame_size}
+    if args.workers > 1:
+        topic_counts, topic_dist = write_articles_sharded(args.output_json, args.workers, **tables)
+    else:
+        topic_counts, topic_dist = write_articles(args.output_json, pids_to_metadata, **tables)
 
     topic_counts = [(t, topic_counts[t]) for t in sorted(topic_counts, key=topic_counts.get, reverse=True)]
     if db == 'enwiki':
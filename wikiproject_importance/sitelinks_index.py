@@ -0,0 +1,286 @@
+import argparse
+from array import array
+from bisect import bisect_left
+import csv
+import json
+import mmap
+import os
+import shutil
+import sys
+import time
+
+# Files that make up an index directory. All arrays are native-endian and memory-mapped on open.
+#   wikis.json        : interned wiki_db codes (position = wiki code) + metadata (incl. size / mtime of the source TSV)
+#   wiki_offsets.bin  : uint32 [num_wikis + 1] -- slice of page_ids / page_qids for each wiki
+#   page_ids.bin      : uint32 -- distinct page IDs, sorted within each wiki's slice
+#   page_qids.bin     : uint32 -- QID (as int) for each page ID
+#   item_qids.bin     : uint32 -- sorted unique QIDs
+#   item_offsets.bin  : uint32 [num_items + 1] -- CSR offsets into the sitelink arrays for each QID
+#   sitelink_wikis.bin: uint16 -- wiki code of each sitelink
+#   sitelink_pids.bin : uint32 -- page ID of each sitelink
+ARRAYS = {'wiki_offsets': 'I', 'page_ids': 'I', 'page_qids': 'I',
+          'item_qids': 'I', 'item_offsets': 'I', 'sitelink_wikis': 'H', 'sitelink_pids': 'I'}
+INDEX_VERSION = 3
+
+
+def qid_to_int(qid):
+    """'Q42' -> 42"""
+    return int(qid[1:])
+
+
+def int_to_qid(qid):
+    """42 -> 'Q42'"""
+    return 'Q{0}'.format(qid)
+
+
+def _write_array(index_dir, name, values):
+    with open(os.path.join(index_dir, name + '.bin'), 'wb') as fout:
+        values.tofile(fout)
+
+
+def source_stat(pid_to_qid_tsv):
+    """Size and modification time of the source TSV -- recorded in the index to detect when it goes stale."""
+    stat = os.stat(pid_to_qid_tsv)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def is_current(index_dir, pid_to_qid_tsv):
+    """Whether `index_dir` holds a complete, compatible index built from the current version of `pid_to_qid_tsv`."""
+    try:
+        with open(os.path.join(index_dir, 'wikis.json'), 'r') as fin:
+            meta = json.load(fin)
+    except (OSError, ValueError):
+        return False
+    return (meta.get('version') == INDEX_VERSION and meta.get('byteorder') == sys.byteorder
+            and meta.get('source_stat') == source_stat(pid_to_qid_tsv))
+
+
+def _sorted_unique(values):
+    """Sorted distinct values of a uint32 array via a presence bitmap (an eighth of a byte per possible value)."""
+    present = bytearray(max(values, default=0) // 8 + 1)
+    for v in values:
+        present[v >> 3] |= 1 << (v & 7)
+    unique = array('I')
+    for i, byte in enumerate(present):
+        while byte:
+            low = byte & -byte
+            unique.append(i * 8 + low.bit_length() - 1)
+            byte ^= low
+    return unique
+
+
+def _counting_sort(keys, num_keys):
+    """Stable order of row positions sorted by small-integer key + offsets of each key's run."""
+    offsets = array('I', bytes(4 * (num_keys + 1)))
+    for k in keys:
+        offsets[k + 1] += 1
+    for k in range(num_keys):
+        offsets[k + 1] += offsets[k]
+    fill = array('I', offsets[:-1])
+    order = array('I', bytes(4 * len(keys)))
+    for i, k in enumerate(keys):
+        order[fill[k]] = i
+        fill[k] += 1
+    return order, offsets
+
+
+def build_index(pid_to_qid_tsv, index_dir, verbose=True):
+    """One-time conversion of the wikidata_item_page_link export (item_id, page_id, wiki_db) into an index directory.
+
+    Sitelinks for each QID keep the order of the TSV and a page ID listed more than once in a wiki maps to the QID
+of its last row, so lookups return the same dictionaries as parsing the TSV.
+    The index is written to a temporary directory and moved into place once complete, so an interrupted build never
+    leaves a partial index at `index_dir`.
+    """
+    start_time = time.time()
+    stat = source_stat(pid_to_qid_tsv)
+    wikis = {}
+    qids = array('I')
+    pids = array('I')
+    wiki_codes = array('H')
+    skipped = 0
+    with open(pid_to_qid_tsv, 'r') as fin:
+        tsvreader = csv.reader(fin, delimiter='\t')
+        assert next(tsvreader) == ['item_id', 'page_id', 'wiki_db']
+        for line in tsvreader:
+            try:
+                qid = qid_to_int(line[0])
+                pid = int(line[1])
+            except (ValueError, IndexError):
+                skipped += 1
+                continue
+            wiki_db = line[2]
+            if wiki_db not in wikis:
+                wikis[wiki_db] = len(wikis)
+            qids.append(qid)
+            pids.append(pid)
+            wiki_codes.append(wikis[wiki_db])
+    if verbose:
+        print("Read {0} sitelinks across {1} wikis ({2} malformed lines skipped) in {3:.1f} minutes.".format(
+            len(qids), len(wikis), skipped, (time.time() - start_time) / 60))
+
+    # page ID -> QID: group rows by wiki and sort by page ID within each wiki (stable, so duplicates stay in TSV
+    # order and the last one is kept)
+    order, wiki_offsets = _counting_sort(wiki_codes, len(wikis))
+    page_ids = array('I')
+    page_qids = array('I')
+    duplicates = 0
+    for w in range(len(wikis)):
+        rows = sorted(order[wiki_offsets[w]:wiki_offsets[w + 1]], key=pids.__getitem__)
+        wiki_offsets[w] = len(page_ids)
+        for j, i in enumerate(rows):
+            if j + 1 < len(rows) and pids[rows[j + 1]] == pids[i]:
+                duplicates += 1
+                continue
+            page_ids.append(pids[i])
+            page_qids.append(qids[i])
+    wiki_offsets[len(wikis)] = len(page_ids)
+    del order
+    if verbose and duplicates:
+        print("{0} duplicate page IDs -- kept the last row for each.".format(duplicates))
+
+    # QID -> sitelinks (CSR): rank the distinct QIDs and counting-sort rows by rank
+    item_qids = _sorted_unique(qids)
+    ranks = array('I', (bisect_left(item_qids, q) for q in qids))
+    order, item_offsets = _counting_sort(ranks, len(item_qids))
+    del ranks
+    sitelink_wikis = array('H', (wiki_codes[i] for i in order))
+    sitelink_pids = array('I', (pids[i] for i in order))
+
+    tmp_dir = '{0}.tmp-{1}'.format(index_dir.rstrip(os.sep), os.getpid())
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name, values in [('wiki_offsets', wiki_offsets), ('page_ids', page_ids), ('page_qids', page_qids),
+                         ('item_qids', item_qids), ('item_offsets', item_offsets),
+                         ('sitelink_wikis', sitelink_wikis), ('sitelink_pids', sitelink_pids)]:
+        _write_array(tmp_dir, name, values)
+    with open(os.path.join(tmp_dir, 'wikis.json'), 'w') as fout:
+        json.dump({'version': INDEX_VERSION,
+                   'byteorder': sys.byteorder,
+                   'source': os.path.abspath(pid_to_qid_tsv),
+                   'source_stat': stat,
+                   'num_sitelinks': len(qids),
+                   'num_items': len(item_qids),
+                   'wikis': sorted(wikis, key=wikis.get)}, fout)
+    if os.path.exists(index_dir):
+        old_dir = tmp_dir + '.old'
+        os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.replace(tmp_dir, index_dir)
+    if verbose:
+        print("Index with {0} items written to {1} after {2:.1f} minutes.".format(
+            len(item_qids), index_dir, (time.time() - start_time) / 60))
+
+
+class SitelinksIndex:
+    """Read-only, memory-mapped page ID <-> QID <-> sitelinks lookups built by `build_index`.
+
+    Opening only maps the files so it takes milliseconds and pages are loaded lazily by the OS.
+    """
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'wikis.json'), 'r') as fin:
+            meta = json.load(fin)
+        if meta['version'] != INDEX_VERSION or meta['byteorder'] != sys.byteorder:
+            raise ValueError("Index at {0} is incompatible -- rebuild it with build_index.".format(index_dir))
+        self.wikis = meta['wikis']
+        self.wiki_codes = {w: i for i, w in enumerate(self.wikis)}
+        self._maps = []
+        for name, typecode in ARRAYS.items():
+            setattr(self, '_' + name, self._map(os.path.join(index_dir, name + '.bin'), typecode))
+
+    def _map(self, fn, typecode):
+        with open(fn, 'rb') as fin:
+            if os.fstat(fin.fileno()).st_size == 0:
+                return memoryview(b'').cast(typecode)
+            mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm).cast(typecode)
+
+    def close(self):
+        for name in ARRAYS:
+            getattr(self, '_' + name).release()
+        for mm in self._maps:
+            mm.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def num_pages(self, wiki_db):
+        """Number of pages in a wiki with a Wikidata item."""
+        w = self.wiki_codes.get(wiki_db)
+        if w is None:
+            return 0
+        return self._wiki_offsets[w + 1] - self._wiki_offsets[w]
+
+    def qid(self, wiki_db, page_id):
+        """QID (e.g., 'Q42') for a page ID in a given wiki or None."""
+        w = self.wiki_codes.get(wiki_db)
+        if w is None:
+            return None
+        lo, hi = self._wiki_offsets[w], self._wiki_offsets[w + 1]
+        i = bisect_left(self._page_ids, page_id, lo, hi)
+        if i < hi and self._page_ids[i] == page_id:
+            return int_to_qid(self._page_qids[i])
+        return None
+
+    def sitelinks(self, qid):
+        """All sitelinks of an item as {wiki_db: page_id} -- e.g., {'enwiki': 19573423, 'ruwiki': 644537}."""
+        q = qid_to_int(qid) if isinstance(qid, str) else qid
+        i = bisect_left(self._item_qids, q)
+        if i == len(self._item_qids) or self._item_qids[i] != q:
+            return {}
+        start, end = self._item_offsets[i], self._item_offsets[i + 1]
+        return {self.wikis[w]: pid for w, pid in zip(self._sitelink_wikis[start:end], self._sitelink_pids[start:end])}
+
+    def page_sitelinks(self, wiki_db, page_id):
+        """(QID, sitelinks) for a page ID in a given wiki or (None, None)."""
+        qid = self.qid(wiki_db, page_id)
+        if qid is None:
+            return None, None
+        return qid, self.sitelinks(qid)
+
+    def pages(self, wiki_db):
+        """Iterate over (page_id, QID) for a wiki in page ID order."""
+        w = self.wiki_codes.get(wiki_db)
+        if w is None:
+            return
+        for i in range(self._wiki_offsets[w], self._wiki_offsets[w + 1]):
+            yield self._page_ids[i], int_to_qid(self._page_qids[i])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pid_to_qid_tsv",
+                        default="./resources/pid_to_qid.tsv",
+                        help="TSV file with full dump of page IDs and QIDs (see gather_wikiprojects_per_article_pageassessments.py)")
+    parser.add_argument("--index_dir",
+                        default="./resources/sitelinks_index",
+                        help="Directory to write the memory-mapped sitelinks index to.")
+    parser.add_argument("--lookup",
+                        nargs='*',
+                        help="Look up QIDs (e.g., Q42) or <wiki_db>:<page_id> pairs in an existing index instead of building it.")
+    args = parser.parse_args()
+
+    if args.lookup is None:
+        build_index(args.pid_to_qid_tsv, args.index_dir)
+    else:
+        with SitelinksIndex(args.index_dir) as index:
+            for key in args.lookup:
+                if ':' in key:
+                    wiki_db, pid = key.split(':', 1)
+                    qid, sitelinks = index.page_sitelinks(wiki_db, int(pid))
+                else:
+                    qid, sitelinks = key, index.sitelinks(key)
+                print(json.dumps({'key': key, 'qid': qid, 'sitelinks': sitelinks}))
+
+
+if __name__ == "__main__":
+    main()
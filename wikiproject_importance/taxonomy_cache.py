@@ -0,0 +1,55 @@
+import hashlib
+import os
+import pickle
+import time
+
+# Bump when the compiled structure or the WikiProject name normalization changes so old artifacts get rebuilt.
+CACHE_VERSION = 1
+
+
+def source_hash(source_fns, extra=()):
+    """SHA-256 over the contents of the source files (+ any extra strings) that an artifact is compiled from."""
+    h = hashlib.sha256('v{0}'.format(CACHE_VERSION).encode('utf-8'))
+    for fn in source_fns:
+        h.update(b'\0' + str(fn).encode('utf-8') + b'\0')
+        if fn and os.path.exists(fn):
+            with open(fn, 'rb') as fin:
+                for block in iter(lambda: fin.read(1 << 20), b''):
+                    h.update(block)
+        else:
+            h.update(b'<missing>')
+    for e in extra:
+        h.update(b'\0' + str(e).encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_or_compile(cache_fn, source_fns, compile_fn, extra=(), verbose=True):
+    """Load compiled data from `cache_fn` if it was built from the current source files, else compile + save it.
+
+    The artifact is a single pickle of {'key': <source hash>, 'data': <compile_fn()>} so loading is one read.
+    """
+    key = source_hash(source_fns, extra)
+    if cache_fn and os.path.exists(cache_fn):
+        try:
+            with open(cache_fn, 'rb') as fin:
+                cached = pickle.load(fin)
+            if cached.get('key') == key:
+                if verbose:
+                    print("Loaded compiled taxonomy from:", cache_fn)
+                return cached['data']
+        except (pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+            pass
+        if verbose:
+            print("Compiled taxonomy at {0} is stale -- rebuilding.".format(cache_fn))
+
+    start_time = time.time()
+    data = compile_fn()
+    if cache_fn:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_fn)), exist_ok=True)
+        tmp_fn = cache_fn + '.tmp'
+        with open(tmp_fn, 'wb') as fout:
+            pickle.dump({'key': key, 'data': data}, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, cache_fn)
+    if verbose:
+        print("Compiled taxonomy in {0:.1f} seconds.".format(time.time() - start_time))
+    return data
@@ -0,0 +1,47 @@
+import json
+import os
+
+MAX_TOPICS = 64  # topics per article are stored as a uint64
+
+
+def vocabulary_fn(output_json):
+    """Sidecar file that records how topics are encoded in a gather output file."""
+    return output_json + '.topics.json'
+
+
+def write_vocabulary(output_json, topics, encoding='bitmask'):
+    """Store the topic vocabulary (bit i = topics[i]) next to a gather output file."""
+    with open(vocabulary_fn(output_json), 'w') as fout:
+        json.dump({'encoding': encoding, 'topics': list(topics)}, fout)
+
+
+def read_vocabulary(output_json):
+    """Topic vocabulary if the gather output file uses bitmask encoding else None."""
+    fn = vocabulary_fn(output_json)
+    if not os.path.exists(fn):
+        return None
+    with open(fn, 'r') as fin:
+        vocab = json.load(fin)
+    if vocab['encoding'] != 'bitmask':
+        return None
+    return vocab['topics']
+
+
+def topic_ids(topics):
+    """Map of topic -> bit position."""
+    if len(topics) > MAX_TOPICS:
+        raise ValueError("{0} topics in vocabulary but bitmask encoding only supports {1}.".format(len(topics), MAX_TOPICS))
+    return {t: i for i, t in enumerate(topics)}
+
+
+def encode(topics, ids):
+    """['Culture.Linguistics', ...] -> int bitmask"""
+    mask = 0
+    for t in topics:
+        mask |= 1 << ids[t]
+    return mask
+
+
+def decode(mask, topics):
+    """int bitmask -> ['Culture.Linguistics', ...] (in vocabulary order)"""
+    return [t for i, t in enumerate(topics) if mask >> i & 1]
@@ -1,11 +1,11 @@
 import argparse
+from array import array
 import bz2
 import csv
 import json
+import os
 
-import pandas as pd
-
-pd.set_option('display.max_rows', 100)
+import topic_bitmask
 
 REMOVE = ['', 'NA', 'na', 'Unknown']
 STANDARDIZE = {'top': 'Top',
@@ -18,6 +18,42 @@ STANDARDIZE = {'top': 'Top',
                'Bottom': 'Low',
                'low': 'Low',
                'Low': 'Low'}
+IMPORTANCE_CATEGORIES = ['no assess.', 'single', 'agreed', 'adjacent', 'two steps', 'full']
+
+def importance_category(assessments):
+    """Categorize an article's (standardized) importance assessments by how much they agree.
+
+    Returns an index into IMPORTANCE_CATEGORIES.
+    """
+    levels = set(assessments)
+    if len(assessments) == 0:
+        return 0  # no assessments
+    elif len(assessments) == 1:
+        return 1  # single assessment
+    elif len(levels) == 1:
+        return 2  # multiple assessments, same level
+    elif 'Top' in levels and 'Low' in levels:
+        return 5  # full range
+    elif ('Top' in levels and 'Mid' in levels) or ('High' in levels and 'Low' in levels):
+        return 4  # two levels apart
+    else:
+        return 3  # one level apart
+
+def _pandas():
+    """Import pandas only once a table is built so --help and the TSV analysis start quickly."""
+    import pandas as pd
+    pd.set_option('display.max_rows', 100)
+    return pd
+
+def ambiguity_table(category_counts):
+    """DataFrame with # of articles and share in each importance category from {key: [count per category]}."""
+    pd = _pandas()
+    df = pd.DataFrame.from_dict(category_counts, orient='index', columns=IMPORTANCE_CATEGORIES)
+    df.insert(0, 'n', df.sum(axis=1))
+    df.insert(3, 'mult assess.', df[IMPORTANCE_CATEGORIES[2:]].sum(axis=1))
+    for c in ['no assess.', 'single', 'mult assess.', 'agreed', 'adjacent', 'two steps', 'full']:
+        df[c] = df[c] / df['n']
+    return df
 
 def complex(fn):
     """Examine article importance in context of article topics.
@@ -34,52 +70,42 @@ def complex(fn):
          "talk_pid": 39941226,
          "topics": ["Culture.Linguistics"]
          }
-    """
 
-    no_assessments = {}
-    articles_per_topic = {}
-    single_assessment = {}
-    single_level = {}
-    adjacent_levels = {}
-    two_steps = {}
-    full_range = {}
-    multiple_assessments = {}
+    If the file was gathered with `--topic_encoding bitmask`, "topics" is an integer and per-topic counts are
+    computed with NumPy over all articles at once.
+    """
+    vocab = topic_bitmask.read_vocabulary(fn)
+    category_counts = {}  # topic -> number of articles in each importance category
+    masks = array('Q')
+    categories = array('B')
     with bz2.open(fn, 'rt') as fin:
         for i, line in enumerate(fin, start=1):
             article_json = json.loads(line)
-            ai_assessments = [STANDARDIZE[a] for a in article_json['importance'] if a not in REMOVE]
-            ai_levels = set(ai_assessments)
-            topics = article_json['topics'] + ['All Articles']
-            for t in topics:
-                articles_per_topic[t] = articles_per_topic.get(t, 0) + 1
-                if len(ai_assessments) == 0:
-                    no_assessments[t] = no_assessments.get(t, 0) + 1
-                elif len(ai_assessments) == 1:
-                    single_assessment[t] = single_assessment.get(t, 0) + 1
-                elif len(ai_levels) == 1:
-                    single_level[t] = single_level.get(t, 0) + 1
-                    multiple_assessments[t] = multiple_assessments.get(t, 0) + 1
-                elif 'Top' in ai_levels and 'Low' in ai_levels:
-                    full_range[t] = full_range.get(t, 0) + 1
-                    multiple_assessments[t] = multiple_assessments.get(t, 0) + 1
-                elif ('Top' in ai_levels and 'Mid' in ai_levels) or ('High' in ai_levels and 'Low' in ai_levels):
-                    two_steps[t] = two_steps.get(t, 0) + 1
-                    multiple_assessments[t] = multiple_assessments.get(t, 0) + 1
-                else:
-                    adjacent_levels[t] = adjacent_levels.get(t, 0) + 1
-                    multiple_assessments[t] = multiple_assessments.get(t, 0) + 1
+            category = importance_category([STANDARDIZE[a] for a in article_json['importance'] if a not in REMOVE])
+            if vocab is None:
+                for t in article_json['topics'] + ['All Articles']:
+                    if t not in category_counts:
+                        category_counts[t] = [0] * len(IMPORTANCE_CATEGORIES)
+                    category_counts[t][category] += 1
+            else:
+                masks.append(article_json['topics'])
+                categories.append(category)
             if i % 500000 == 0:
                 print("{0} items evaluated".format(i))
 
+    if vocab is not None:
+        import numpy as np
 
-    df = pd.DataFrame([articles_per_topic, no_assessments, single_assessment,
-                       multiple_assessments, single_level, adjacent_levels, two_steps, full_range]).T
-    df.columns = ['n', 'no assess.', 'single',
-                  'mult assess.', 'agreed', 'adjacent', 'two steps', 'full']
-    for c in ['no assess.', 'single', 'mult assess.', 'agreed', 'adjacent', 'two steps', 'full']:
-        df[c] = df[c] / df['n']
+        masks = np.frombuffer(masks, dtype=np.uint64)
+        categories = np.frombuffer(categories, dtype=np.uint8)
+        for bit, t in enumerate(vocab):
+            in_topic = ((masks >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+            counts = np.bincount(categories[in_topic], minlength=len(IMPORTANCE_CATEGORIES))
+            if counts.sum():
+                category_counts[t] = counts.tolist()
+        category_counts['All Articles'] = np.bincount(categories, minlength=len(IMPORTANCE_CATEGORIES)).tolist()
 
-    df['n'] = df['n'].apply(lambda x: int(x))
+    df = ambiguity_table(category_counts)
     print(df)
     print()
     print(df.sort_values(by='mult assess.', ascending=False))
@@ -89,12 +115,7 @@ def simple(fn):
     """Quick script for gathering importance level counts and some basic statistics on ambiguity."""
     levels = {}
 
-    no_assessments = 0
-    single_assess = 0
-    single_level = 0
-    adjacent_levels = 0
-    full_range = 0
-    two_step = 0
+    category_counts = [0] * len(IMPORTANCE_CATEGORIES)
     with open(fn, 'r') as fin:
         tsvreader = csv.reader(fin, delimiter='\t')
         header = next(tsvreader)
@@ -111,18 +132,8 @@ def simple(fn):
                     sais.append(sai_assessment)
                 else:
                     print("Unexpected level '{0}' from line {1}: {2}".format(ai_assessment, i, line))
-            if len(sais) == 0:
-                no_assessments += 1
-            elif len(sais) == 1:
-                single_assess += 1
-            elif len(set(sais)) == 1:
-                single_level += 1
-            elif 'Top' in sais and 'Low' in sais:
-                full_range += 1
-            elif ('Top' in sais and 'Mid' in sais) or ('High' in sais and 'Low' in sais):
-                two_step += 1
-            else:
-                adjacent_levels += 1
+            category_counts[importance_category(sais)] += 1
+    no_assessments, single_assess, single_level, adjacent_levels, two_step, full_range = category_counts
 
     assert len(levels) == 4
     print("Count of each articles at each level:")
@@ -137,11 +148,188 @@ def simple(fn):
     print("Multiple assessments, two levels apart: {0} ({1:.3f})".format(two_step, two_step / i))
     print("Full range (Low and Top) of assessments: {0} ({1:.3f})".format(full_range, full_range / i))
 
-def main():
+REPORTS = {}
+
+def register_report(cls):
+    """Make a Report available to run_reports / --reports under its name."""
+    REPORTS[cls.name] = cls
+    return cls
+
+class Report:
+    """Accumulates one table during a shared pass over the gather output.
+
+    `add` is called once per article (see `parse_article` for the extra fields) and `table` returns a DataFrame at the end.
+    """
+    name = None
+
+    def add(self, article):
+        raise NotImplementedError
+
+    def table(self):
+        raise NotImplementedError
+
+class CategoryReport(Report):
+    """Importance-ambiguity breakdown (same columns as `complex`) for whatever keys an article maps to."""
+    index_name = None
+
+    def __init__(self):
+        self.category_counts = {}
+
+    def keys(self, article):
+        raise NotImplementedError
+
+    def add(self, article):
+        for k in self.keys(article):
+            if k not in self.category_counts:
+                self.category_counts[k] = [0] * len(IMPORTANCE_CATEGORIES)
+            self.category_counts[k][article['category']] += 1
+
+    def table(self):
+        df = ambiguity_table(self.category_counts)
+        df.index.name = self.index_name
+        return df
+
+@register_report
+class TopicAmbiguity(CategoryReport):
+    name = 'topic_ambiguity'
+    index_name = 'topic'
+
+    def keys(self, article):
+        return article['topics'] + ['All Articles']
+
+@register_report
+class WikiProjectDisagreement(CategoryReport):
+    name = 'wikiproject_disagreement'
+    index_name = 'wikiproject'
+
+    def keys(self, article):
+        return article['wp_templates']
+
+    def table(self):
+        return super().table().sort_values(by='n', ascending=False)
+
+@register_report
+class AgreementByNumProjects(CategoryReport):
+    name = 'agreement_by_num_projects'
+    index_name = 'num_projects'
+
+    def keys(self, article):
+        return [len(article['wp_templates'])]
+
+    def table(self):
+        return super().table().sort_index()
+
+SITELINK_BUCKETS = [(0, '0'), (1, '1'), (2, '2-5'), (6, '6-10'), (11, '11-25'), (26, '26-50'), (51, '51+')]
+
+@register_report
+class AgreementBySitelinks(CategoryReport):
+    name = 'agreement_by_sitelinks'
+    index_name = 'sitelinks'
+
+    def keys(self, article):
+        num_sitelinks = len(article.get('sitelinks', {}))
+        return [[label for lower, label in SITELINK_BUCKETS if num_sitelinks >= lower][-1]]
+
+    def table(self):
+        df = super().table()
+        return df.reindex([label for _, label in SITELINK_BUCKETS if label in df.index])
+
+@register_report
+class ImportanceByQuality(Report):
+    """# of articles with each (standardized importance level, quality class) assessment pair."""
+    name = 'importance_by_quality'
+
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, article):
+        levels = set(article['assessments']) or {'None'}
+        classes = set(q for q in article.get('quality', []) if q not in REMOVE) or {'None'}
+        for level in levels:
+            for quality in classes:
+                self.counts[(level, quality)] = self.counts.get((level, quality), 0) + 1
+
+    def table(self):
+        pd = _pandas()
+        df = pd.Series(self.counts, dtype='int64').unstack(fill_value=0)
+        df = df.reindex([l for l in ['Top', 'High', 'Mid', 'Low', 'None'] if l in df.index])
+        df.index.name = 'importance'
+        df.columns.name = 'quality'
+        return df
+
+def parse_article(article_json, vocab=None):
+    """Add standardized importance assessments, their ambiguity category, and topic names to a gather output item."""
+    article_json['assessments'] = [STANDARDIZE[a] for a in article_json['importance'] if a not in REMOVE]
+    article_json['category'] = importance_category(article_json['assessments'])
+    if vocab is not None:
+        article_json['topics'] = topic_bitmask.decode(article_json['topics'], vocab)
+    return article_json
+
+def run_reports(fn, report_names):
+    """Compute several reports in a single pass over a gather output file. Returns {report name: DataFrame}."""
+    vocab = topic_bitmask.read_vocabulary(fn)
+    reports = [REPORTS[name]() for name in report_names]
+    with bz2.open(fn, 'rt') as fin:
+        for i, line in enumerate(fin, start=1):
+            article = parse_article(json.loads(line), vocab)
+            for report in reports:
+                report.add(article)
+            if i % 500000 == 0:
+                print("{0} items evaluated".format(i))
+    return {report.name: report.table() for report in reports}
+
+def parquet_engine():
+    """Name of an installed engine pandas can write parquet with (pyarrow / fastparquet), or None.
+
+    Only looks the packages up so the check is cheap enough to run before reading any input.
+    """
+    import importlib.util
+    for engine in ('pyarrow', 'fastparquet'):
+        if importlib.util.find_spec(engine) is not None:
+            return engine
+    return None
+
+def write_tables(tables, output_dir, output_format='csv'):
+    """Write each report to <output_dir>/<report name>.csv (or .parquet -- requires pyarrow or fastparquet)."""
+    os.makedirs(output_dir, exist_ok=True)
+    for name, df in tables.items():
+        output_fn = os.path.join(output_dir, '{0}.{1}'.format(name, output_format))
+        if output_format == 'parquet':
+            df.to_parquet(output_fn)
+        else:
+            df.to_csv(output_fn)
+        print("Wrote {0} ({1} rows) to {2}".format(name, len(df), output_fn))
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_fn", help="TSV or JSON file with importance ratings")
-    args = parser.parse_args()
-    if args.input_fn.endswith('.tsv'):
+    parser.add_argument("--reports",
+                        nargs='*',
+                        choices=sorted(REPORTS),
+                        help="Compute these reports in one pass over a Bzipped JSON file instead of the default analysis. "
+                             "No names = all reports.")
+    parser.add_argument("--output_dir",
+                        help="Directory to write report tables to. If not set, tables are printed.")
+    parser.add_argument("--output_format",
+                        default="csv",
+                        choices=["csv", "parquet"],
+                        help="Format for report tables in --output_dir.")
+    args = parser.parse_args(argv)
+    if args.reports is not None and not args.input_fn.endswith('.json.bz2'):
+        parser.error("--reports requires a Bzipped JSON (.json.bz2) --input_fn")
+    if args.output_dir and args.reports is None:
+        parser.error("--output_dir is only used with --reports")
+    if args.output_dir and args.output_format == 'parquet' and parquet_engine() is None:
+        parser.error("--output_format parquet requires pyarrow or fastparquet")
+    if args.reports is not None:
+        tables = run_reports(args.input_fn, args.reports or sorted(REPORTS))
+        if args.output_dir:
+            write_tables(tables, args.output_dir, args.output_format)
+        else:
+            for name, df in tables.items():
+                print("\n{0}:".format(name))
+                print(df)
+    elif args.input_fn.endswith('.tsv'):
         simple(args.input_fn)
     elif args.input_fn.endswith('.json.bz2'):
         complex(args.input_fn)